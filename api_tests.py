@@ -1,5 +1,7 @@
 import requests
 import json
+import struct
+import zlib
 
 
 class RaspberryPiClient:
@@ -11,12 +13,13 @@ class RaspberryPiClient:
         """
         self.base_url = f"http://{ip}:{port}"
 
-    def send_request(self, endpoint, method="GET", data=None):
+    def send_request(self, endpoint, method="GET", data=None, content_type="application/octet-stream"):
         """
         Generic method to send an HTTP request to the Raspberry Pi.
         :param endpoint: API endpoint to call (e.g., '/system')
         :param method: HTTP method ('GET', 'POST', etc.)
-        :param data: Data to send with the request (for POST/PUT requests)
+        :param data: Data to send with the request (for POST/PUT requests).
+                     Bytes are sent as a raw body of type `content_type`.
         :return: Response JSON or error message
         """
         url = f"{self.base_url}{endpoint}"
@@ -24,8 +27,12 @@ class RaspberryPiClient:
         try:
             if method == "GET":
                 response = requests.get(url, params=data)
+            elif method == "POST" and isinstance(data, (bytes, bytearray)):
+                response = requests.post(url, data=data, headers={"Content-Type": content_type})
             elif method == "POST":
                 response = requests.post(url, json=data)
+            elif method == "PATCH":
+                response = requests.patch(url, json=data)
             else:
                 return f"Unsupported HTTP method: {method}"
 
@@ -82,6 +89,81 @@ class RaspberryPiClient:
         """
         return self.send_request("/slots", method="GET")
 
+    def get_slot_metadata(self):
+        """
+        Fetch duration, CRC, size and frame count of every slot, without pixels.
+        :return: Slot metadata JSON or an error message
+        """
+        return self.send_request("/slots", method="GET", data={"metadata": "true"})
+
+    def get_manifest(self):
+        """
+        Fetch the CRC, duration and generation of every slot.
+        :return: Manifest JSON or an error message
+        """
+        return self.send_request("/slots/manifest", method="GET")
+
+    def sync_slots(self, playlist, clear_missing=False, preempt=False):
+        """
+        Bring the device in line with a local playlist, uploading only the slots
+        whose CRC, frame delays or duration differ from the device manifest, in one batch.
+        :param playlist: {slot: {"duration": seconds, "pixels": [...]}}, or for an animation
+                         {slot: {"duration": seconds, "frames": [[...], ...], "delays": [...]}}.
+        :param clear_missing: Also clear device slots that are not in the playlist.
+        :param preempt: Show the first uploaded slot right away instead of waiting for the rotation.
+        :return: Dict listing the uploaded, unchanged, cleared and failed slots
+        """
+        manifest = self.get_manifest()
+        if "error" in manifest:
+            return manifest
+        device_slots = manifest["slots"]
+        summary = {"uploaded": [], "unchanged": [], "cleared": [], "failed": {}}
+
+        changed = {}
+        for slot, entry in playlist.items():
+            slot = str(slot)
+            frames = entry.get("frames") or [entry["pixels"]]
+            delays = (entry.get("delays") or [0.1] * len(frames)) if len(frames) > 1 else None
+            current = device_slots.get(slot)
+            if (current and current["crc"] == pixels_crc(frames)
+                    and current.get("delays_crc", 0) == delays_crc(delays)
+                    and float32(current["duration"]) == float32(entry["duration"])):
+                summary["unchanged"].append(slot)
+            else:
+                changed[slot] = entry
+
+        if changed:
+            result = self.set_images_batch(changed, preempt=preempt)
+            if "error" in result:
+                summary["failed"] = {slot: result for slot in changed}
+            else:
+                summary["uploaded"] = list(changed)
+
+        if clear_missing:
+            for slot, current in device_slots.items():
+                if current and slot not in {str(key) for key in playlist}:
+                    self.clear_slot(slot)
+                    summary["cleared"].append(slot)
+        return summary
+
+    def get_image_binary(self, slot, etag=None):
+        """
+        Fetch a slot as the binary upload format, skipping the download if it is unchanged.
+        :param slot: Slot number to fetch the image data from.
+        :param etag: ETag from a previous call; the server answers 304 if the slot still matches.
+        :return: (etag, body bytes), with body None if unchanged, or an error dict
+        """
+        headers = {"If-None-Match": etag} if etag else {}
+        try:
+            response = requests.get(f"{self.base_url}/image", params={"slot": slot, "format": "binary"}, headers=headers)
+            if response.status_code == 304:
+                return etag, None
+            if response.status_code == 200:
+                return response.headers.get("ETag"), response.content
+            return {"error": f"Request failed with status {response.status_code}", "details": response.text}
+        except Exception as e:
+            return {"error": str(e)}
+
     def clear_slot(self, slot_number):
         """
         Test clearing a specific slot using the /slots/clear endpoint.
@@ -96,14 +178,142 @@ class RaspberryPiClient:
         """
         return self.send_request("/image", method="GET", data={"slot": slot})
 
+    def set_image(self, slot, duration, pixels):
+        """
+        Upload image data to a slot as JSON.
+        :param slot: Slot number to store the image in.
+        :param duration: How long the slot is displayed, in seconds.
+        :param pixels: List of 64x64 signed ARGB integers.
+        :return: Response JSON or error message.
+        """
+        pixel_data = struct.pack(f"!{len(pixels)}i", *pixels)
+        data = {"slot": slot, "duration": duration, "pixels": pixels, "crc": zlib.crc32(pixel_data) & 0xFFFFFFFF}
+        return self.send_request("/image", method="POST", data=data)
+
+    def set_animation(self, slot, duration, frames, delays):
+        """
+        Upload an animated slot as JSON.
+        :param slot: Slot number to store the animation in.
+        :param duration: How long the slot is displayed, in seconds.
+        :param frames: List of frames, each a list of 64x64 signed ARGB integers.
+        :param delays: Seconds each frame stays on the panel.
+        :return: Response JSON or error message.
+        """
+        crc = 0
+        for pixels in frames:
+            crc = zlib.crc32(struct.pack(f"!{len(pixels)}i", *pixels), crc)
+        data = {"slot": slot, "duration": duration, "crc": crc & 0xFFFFFFFF,
+                "frames": [{"pixels": pixels, "delay": delay} for pixels, delay in zip(frames, delays)]}
+        return self.send_request("/image", method="POST", data=data)
+
+    def set_image_binary(self, slot, duration, pixels):
+        """
+        Upload image data to a slot as a binary body: slot, duration and crc
+        (big-endian int, float, unsigned int) followed by big-endian ARGB words.
+        About a third of the size of the JSON upload.
+        :param slot: Slot number to store the image in.
+        :param duration: How long the slot is displayed, in seconds.
+        :param pixels: List of 64x64 signed ARGB integers.
+        :return: Response JSON or error message.
+        """
+        pixel_data = struct.pack(f"!{len(pixels)}i", *pixels)
+        header = struct.pack("!ifI", int(slot), duration, zlib.crc32(pixel_data) & 0xFFFFFFFF)
+        return self.send_request("/image", method="POST", data=header + pixel_data)
+
+    def set_images_batch(self, playlist, preempt=True):
+        """
+        Upload several slots in one request. All-still playlists are sent in the
+        binary format, anything with animations as JSON.
+        :param playlist: {slot: {"duration": seconds, "pixels": [...]}}, or for an animation
+                         {slot: {"duration": seconds, "frames": [[...], ...], "delays": [...]}}.
+        :param preempt: Show the first slot right away; False only adds the slots to the rotation.
+        :return: Response JSON or error message.
+        """
+        if all("frames" not in entry for entry in playlist.values()):
+            body = b""
+            for slot, entry in playlist.items():
+                pixel_data = struct.pack(f"!{len(entry['pixels'])}i", *entry["pixels"])
+                body += struct.pack("!ifI", int(slot), entry["duration"], zlib.crc32(pixel_data) & 0xFFFFFFFF)
+                body += pixel_data
+            return self.send_request(f"/image/batch?preempt={str(preempt).lower()}", method="POST", data=body)
+
+        slots = []
+        for slot, entry in playlist.items():
+            frames = entry.get("frames") or [entry["pixels"]]
+            delays = entry.get("delays") or [0.1] * len(frames)
+            slots.append({"slot": slot, "duration": entry["duration"], "crc": pixels_crc(frames),
+                          "frames": [{"pixels": pixels, "delay": delay} for pixels, delay in zip(frames, delays)]})
+        return self.send_request("/image/batch", method="POST", data={"slots": slots, "preempt": preempt})
+
+    def set_image_file(self, slot, duration, file_path):
+        """
+        Upload a JPEG, PNG or GIF file; the Raspberry Pi scales and crops it to the panel.
+        :param slot: Slot number to store the image in.
+        :param duration: How long the slot is displayed, in seconds.
+        :param file_path: Path to the image file.
+        :return: Response JSON or error message.
+        """
+        with open(file_path, "rb") as file:
+            raw = file.read()
+        content_type = {".png": "image/png", ".gif": "image/gif"}.get(file_path[-4:].lower(), "image/jpeg")
+        endpoint = f"/image?slot={slot}&duration={duration}&crc={zlib.crc32(raw) & 0xFFFFFFFF}"
+        return self.send_request(endpoint, method="POST", data=raw, content_type=content_type)
+
+    def patch_image(self, slot, x, y, width, height, pixels, frame_crc):
+        """
+        Update a rectangle of a still slot without resending the whole frame.
+        :param slot: Slot number to patch.
+        :param x, y: Top-left corner of the rectangle.
+        :param width, height: Size of the rectangle.
+        :param pixels: width*height signed ARGB integers, row by row.
+        :param frame_crc: CRC of the whole frame after the patch is applied.
+        :return: Response JSON or error message.
+        """
+        data = {"slot": slot, "x": x, "y": y, "width": width, "height": height, "pixels": pixels, "crc": frame_crc}
+        return self.send_request("/image", method="PATCH", data=data)
+
     def display_image(self, image_data):
         """
         Send image data to the Raspberry Pi for display.
         :param image_data: Dictionary containing image data.
-        :return: Response JSON or error message.
+        :return: Response JSON with the job ID, or an error message.
         """
         return self.send_request("/display_image", method="POST", data=image_data)
 
+    def get_display_job(self, job_id):
+        """
+        Check the status of an image queued with display_image.
+        :param job_id: The job ID returned by display_image.
+        :return: Job status JSON or error message.
+        """
+        return self.send_request(f"/display_image/{job_id}", method="GET")
+
+
+def pixels_crc(frames):
+    """
+    CRC32 of one or more frames of signed ARGB integers, as the Raspberry Pi computes it.
+    """
+    crc = 0
+    for pixels in frames:
+        crc = zlib.crc32(struct.pack(f"!{len(pixels)}i", *pixels), crc)
+    return crc & 0xFFFFFFFF
+
+
+def float32(value):
+    """
+    A duration as the Raspberry Pi stores it (a float32), so 0.3 compares equal to 0.30000001192092896.
+    """
+    return struct.unpack("!f", struct.pack("!f", value))[0]
+
+
+def delays_crc(delays):
+    """
+    CRC32 of an animation's frame delays as the Raspberry Pi stores them (big-endian floats), 0 for a still image.
+    """
+    if not delays:
+        return 0
+    return zlib.crc32(struct.pack(f"!{len(delays)}f", *delays)) & 0xFFFFFFFF
+
 
 def load_image_data_from_json(file_path):
     """
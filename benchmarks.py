@@ -0,0 +1,301 @@
+import asyncio
+import contextlib
+import gc
+import glob
+import io
+import random
+import socket
+import struct
+import threading
+import time
+import tracemalloc
+import zlib
+
+from PIL import Image
+
+from display_backend import VirtualMatrixBackend
+from frame_cache import FrameCache
+from image_ingest import IngestCache, decode_upload
+from gpio_backend import MockGPIO, RecordingGPIOBackend, RPiGPIOBackend
+from led_hub import LEDMatrix
+from wifi_connection import FRAME_HEADER, FRAME_MAGIC, STATUS_OK, UploadServer, decode_data, recv_exact
+from renderer import FrameRenderer
+from slot_store import pack_pixels
+
+
+def measure(func, *args, repeat=20):
+    """
+    Run `func(*args)` `repeat` times and return the best wall time in milliseconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = (time.perf_counter() - start) * 1000
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def random_pixels(width, height):
+    return [random.randint(-2 ** 31, 2 ** 31 - 1) for _ in range(width * height)]
+
+
+def legacy_calculate_crc(image):
+    """The per-pixel to_bytes loop calculate_crc used before it packed with array('i')."""
+    byte_data = bytearray()
+    for value in image:
+        byte_data.extend(value.to_bytes(4, byteorder='big', signed=True))
+    return zlib.crc32(byte_data) & 0xFFFFFFFF
+
+
+def packed_calculate_crc(image):
+    """What /image POST does now: pack once, then a single zlib.crc32."""
+    return zlib.crc32(pack_pixels(image)) & 0xFFFFFFFF
+
+
+def benchmark_crc(sizes=((64, 64), (128, 128), (256, 256))):
+    """
+    Upload-validation latency of the CRC check, before and after vectorizing it.
+    """
+    print("CRC validation (best of 20, ms)")
+    print(f"{'frame':>10} {'legacy':>10} {'packed':>10} {'speedup':>8}")
+    for width, height in sizes:
+        pixels = random_pixels(width, height)
+        if legacy_calculate_crc(pixels) != packed_calculate_crc(pixels):
+            raise AssertionError("Packed CRC differs from the Java-compatible CRC")
+        legacy = measure(legacy_calculate_crc, pixels)
+        packed = measure(packed_calculate_crc, pixels)
+        print(f"{f'{width}x{height}':>10} {legacy:>10.3f} {packed:>10.3f} {legacy / packed:>7.1f}x")
+
+
+def random_slot(width=64, height=64):
+    data = pack_pixels(random_pixels(width, height))
+    return {"duration": 1, "crc": zlib.crc32(data) & 0xFFFFFFFF, "width": width, "height": height, "data": data}
+
+
+def benchmark_render(number_of_slots=6, rounds=50):
+    """
+    Render latency through the renderer on the virtual matrix: a cold frame
+    (decode, draw, swap) and a warm rotation through already decoded slots.
+    """
+    slots = [random_slot() for _ in range(number_of_slots)]
+    display = VirtualMatrixBackend()
+
+    def cold():
+        FrameRenderer(display, FrameCache(max_entries=number_of_slots)).show(slots[0])
+
+    renderer = FrameRenderer(display, FrameCache(max_entries=number_of_slots))
+
+    def rotation():
+        for slot_data in slots:
+            renderer.show(slot_data)
+
+    rotation()
+    cold_ms = measure(cold, repeat=rounds)
+    warm_ms = measure(rotation, repeat=rounds) / number_of_slots
+    print("Render latency on the virtual matrix (best of runs, ms)")
+    print(f"{'cold frame':>24} {cold_ms:>10.3f}")
+    print(f"{'cached slot in rotation':>24} {warm_ms:>10.3f}")
+
+
+def benchmark_ingest(pattern="sample*.jpg", width=64, height=64):
+    """
+    Server-side ingestion of the sample photos: full decode and resize,
+    JPEG draft-mode decode, and a re-upload served from the ingest cache.
+    """
+    print("Image ingestion to 64x64 (best of 5, ms)")
+    print(f"{'file':>12} {'full':>10} {'draft':>10} {'cached':>10}")
+    for path in sorted(glob.glob(pattern)):
+        with open(path, 'rb') as f:
+            raw = f.read()
+        cache = IngestCache()
+        cache.decode(raw, width, height)
+        full = measure(decode_upload, raw, width, height, 64, False, repeat=5)
+        draft = measure(decode_upload, raw, width, height, 64, True, repeat=5)
+        cached = measure(cache.decode, raw, width, height, repeat=5)
+        print(f"{path:>12} {full:>10.3f} {draft:>10.3f} {cached:>10.3f}")
+
+
+def random_image(width=64, height=64):
+    image = Image.new("RGB", (width, height))
+    image.putdata([(random.randrange(256), random.randrange(256), random.randrange(256))
+                   for _ in range(width * height)])
+    return image
+
+
+def benchmark_led_refresh(bit_depths=(1, 2, 3, 4), seconds=2.0):
+    """
+    Off-device refresh rate of the software-driven led_hub panel, through
+    RPiGPIOBackend on MockGPIO (multi-pin output() calls) and through the
+    recording backend (bare mask writes, the floor for a register backend).
+    Actual GPIO writes on a Pi are slower, so compare the numbers between
+    versions rather than against real panels.
+    """
+    frames = [random_image() for _ in range(4)]
+    backends = {"rpi.gpio": lambda: RPiGPIOBackend(MockGPIO()), "recording": RecordingGPIOBackend}
+    print(f"led_hub refresh loop off-device ({seconds:.0f} s per run)")
+    print(f"{'backend':>10} {'bits':>6} {'refresh/s':>10} {'writes/refresh':>15}")
+    for name, backend_factory in backends.items():
+        for bit_depth in bit_depths:
+            backend = backend_factory()
+            led_matrix = LEDMatrix(backend=backend, frame_images=frames, bit_depth=bit_depth)
+            refreshes = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                led_matrix.update_led_matrix(refreshes % led_matrix.DISPLAY_FRAMES)
+                refreshes += 1
+            elapsed = time.perf_counter() - start
+            writes = backend.gpio.writes if name == "rpi.gpio" else backend.writes
+            print(f"{name:>10} {bit_depth:>6} {refreshes / elapsed:>10.1f} {writes // refreshes:>15}")
+
+def legacy_decode_pixels(sock):
+    """The Pico receive loop before the length-prefixed mode: 4 bytes per recv, a print and gc every 256."""
+    pixels = bytearray()
+    while True:
+        for _ in range(256):
+            pixel_data = recv_exact(sock, 4)
+            if not pixel_data:
+                return pixels
+            pixels.extend(pixel_data)
+            print(pixel_data)
+        gc.collect()
+
+
+def measure_transfer(payload, receive):
+    """Send `payload` over a socketpair; returns (ms, peak traced heap in bytes, received byte count)."""
+    receiver, sender = socket.socketpair()
+
+    def send():
+        sender.sendall(payload)
+        sender.close()
+
+    thread = threading.Thread(target=send)
+    tracemalloc.start()
+    start = time.perf_counter()
+    thread.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        pixels = receive(receiver)
+    elapsed = (time.perf_counter() - start) * 1000
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    thread.join()
+    receiver.close()
+    return elapsed, peak, len(pixels)
+
+
+def benchmark_pico_receive(width=64, height=64):
+    """
+    The Pico's Wi-Fi upload path run under CPython on a socketpair: transfer
+    time and peak heap growth (tracemalloc) for one frame, legacy stream vs
+    the length-prefixed recv_into mode.
+    """
+    pixels = pack_pixels(random_pixels(width, height))
+    legacy_payload = struct.pack('!if', 0, 10.0) + pixels
+    framed_payload = FRAME_MAGIC + struct.pack(FRAME_HEADER, 0, 10.0, zlib.crc32(pixels), len(pixels)) + pixels
+
+    def legacy(sock):
+        recv_exact(sock, 8)
+        return legacy_decode_pixels(sock)
+
+    def framed(sock):
+        return decode_data(sock)[2]
+
+    print(f"Pico upload receive, {width}x{height} frame")
+    print(f"{'mode':>16} {'ms':>10} {'peak heap':>10} {'bytes':>8}")
+    for name, payload, receive in (("legacy", legacy_payload, legacy), ("length-prefixed", framed_payload, framed)):
+        elapsed, peak, received = measure_transfer(payload, receive)
+        print(f"{name:>16} {elapsed:>10.3f} {peak:>10} {received:>8}")
+
+
+class MemoryStreamReader:
+    """
+    In-memory stand-in for an asyncio StreamReader, to drive the Pico's
+    UploadServer under CPython. Each read returns at most `chunk_size` bytes
+    and yields to the event loop first, like a socket receiving packets.
+    """
+
+    def __init__(self, data, chunk_size=1460):
+        self.data = memoryview(data)
+        self.chunk_size = chunk_size
+
+    async def read(self, size):
+        await asyncio.sleep(0)
+        chunk = bytes(self.data[:min(size, self.chunk_size)])
+        self.data = self.data[len(chunk):]
+        return chunk
+
+
+class MemoryStreamWriter:
+    """Collects the status bytes UploadServer writes back."""
+
+    def __init__(self):
+        self.written = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.written += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+def benchmark_pico_upload_server(clients=4, uploads_per_client=3, width=64, height=64):
+    """
+    The Pico's asyncio UploadServer under CPython: `clients` connections at
+    once, each sending several length-prefixed frames through in-memory
+    streams. Reports total time, peak heap growth (tracemalloc), whether
+    every upload was stored and acknowledged, and how often a background
+    task got to run during the transfers.
+    """
+    frames = [pack_pixels(random_pixels(width, height)) for _ in range(clients)]
+    payloads = [(FRAME_MAGIC + struct.pack(FRAME_HEADER, slot, 10.0, zlib.crc32(pixels), len(pixels)) + pixels)
+                * uploads_per_client for slot, pixels in enumerate(frames)]
+    stored = []
+
+    async def run():
+        upload_server = UploadServer(on_slot=lambda slot, duration, pixels: stored.append((slot, zlib.crc32(pixels))))
+        background_runs = 0
+
+        async def background():
+            nonlocal background_runs
+            while True:
+                background_runs += 1
+                await asyncio.sleep(0)
+
+        task = asyncio.create_task(background())
+        writers = [MemoryStreamWriter() for _ in range(clients)]
+        await asyncio.gather(*(upload_server.handle_client(MemoryStreamReader(payload), writer)
+                               for payload, writer in zip(payloads, writers)))
+        task.cancel()
+        return upload_server, writers, background_runs
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        upload_server, writers, background_runs = asyncio.run(run())
+    elapsed = (time.perf_counter() - start) * 1000
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    acknowledged = all(writer.written == STATUS_OK * uploads_per_client and writer.closed for writer in writers)
+    intact = len(stored) == clients * uploads_per_client and all(crc == zlib.crc32(frames[slot]) for slot, crc in stored)
+    print(f"Pico upload server, {clients} clients x {uploads_per_client} {width}x{height} frames")
+    print(f"{'ms':>10} {'peak heap':>10} {'uploads':>8} {'failed':>7} {'acked':>6} {'intact':>7} {'background':>11}")
+    print(f"{elapsed:>10.3f} {peak:>10} {upload_server.uploads:>8} {upload_server.failed:>7} "
+          f"{str(acknowledged):>6} {str(intact):>7} {background_runs:>11}")
+
+
+if __name__ == "__main__":
+    benchmark_crc()
+    benchmark_render()
+    benchmark_ingest()
+    benchmark_led_refresh()
+    benchmark_pico_receive()
+    benchmark_pico_upload_server()
@@ -2,13 +2,18 @@ import bluetooth
 import random
 import struct
 import time
+from binascii import crc32
 from machine import Pin
 
+import micropython
 from micropython import const
 
+from wifi_connection import MAX_FRAME_BYTES, NUMBER_OF_SLOTS, write_slot
+
 _IRQ_CENTRAL_CONNECT = const(1)
 _IRQ_CENTRAL_DISCONNECT = const(2)
 _IRQ_GATTS_WRITE = const(3)
+_IRQ_MTU_EXCHANGED = const(21)
 
 _FLAG_READ = const(0x0002)
 _FLAG_WRITE_NO_RESPONSE = const(0x0004)
@@ -43,7 +48,7 @@ _PICOFRAME_DESCRIPTOR = (
 # Custom name
 _PICOFRAME_CHARACTERISTIC = (
     _PICOFRAME_CHARACTERISTIC_UUID,
-    _FLAG_READ | _FLAG_WRITE | _FLAG_NOTIFY,
+    _FLAG_READ | _FLAG_WRITE | _FLAG_WRITE_NO_RESPONSE | _FLAG_NOTIFY,
     (_PICOFRAME_DESCRIPTOR,)
 )
 
@@ -52,6 +57,45 @@ _PICOFRAME_SERVICE_UUID = bluetooth.UUID('00001001-0000-1000-8000-00805F9B34FB')
 
 _PICOFRAME_SERVICE = (_PICOFRAME_SERVICE_UUID, (_PICOFRAME_CHARACTERISTIC,))
 
+# Frame transfers over the PicoFrame characteristic. The central writes
+# (without response) a START, then DATA chunks carrying their byte offset;
+# the device notifies ACKs. Up to _TRANSFER_WINDOW chunks may be in flight:
+# the device acks every _ACK_EVERY chunks with the contiguous byte count it
+# holds, so the central keeps sending while acks come back. A chunk arriving
+# past a gap (a write the stack overwrote before it was read) gets a NACK
+# with the offset to resend from. The last ACK reports the CRC check.
+_PREFERRED_MTU = const(247)
+_ATT_HEADER_SIZE = const(3)
+_TRANSFER_WINDOW = const(16)
+_ACK_EVERY = const(8)
+
+_MSG_START = const(0x01)
+_MSG_DATA = const(0x02)
+_MSG_ACK = const(0x03)
+
+_STATUS_OK = const(0)
+_STATUS_NACK = const(1)
+_STATUS_DONE = const(2)
+_STATUS_CRC_ERROR = const(3)
+_STATUS_BUSY = const(4)
+_STATUS_INVALID = const(5)
+
+# Outbound notifications are queued per connection and split to the MTU.
+# When the controller has no room (gatts_notify raises), flushing backs off,
+# doubling from _BACKOFF_MIN_MS up to _BACKOFF_MAX_MS. Past _MAX_QUEUED_BYTES
+# the oldest queued notifications are dropped.
+_DEFAULT_MTU = const(23)
+_MAX_QUEUED_BYTES = const(2048)
+_BACKOFF_MIN_MS = const(5)
+_BACKOFF_MAX_MS = const(200)
+
+# Message formats are plain strings: MicroPython's struct has no Struct class.
+_START = "!BBfII"  # type, slot, duration, length, crc
+_DATA = "!BI"  # type, offset, then the chunk bytes
+_ACK = "!BBIHH"  # type, status, bytes received, window, max chunk size
+_START_SIZE = struct.calcsize(_START)
+_DATA_SIZE = struct.calcsize(_DATA)
+
 _ADV_TYPE_FLAGS = const(0x01)
 _ADV_TYPE_NAME = const(0x09)
 _ADV_TYPE_UUID16_COMPLETE = const(0x3)
@@ -95,17 +139,197 @@ def advertising_payload(limited_disc=False, br_edr=False, name=None, services=No
     return payload
 
 
+class FrameTransfer:
+    """
+    Receiving side of the chunked frame transfer, independent of the BLE stack.
+
+    `handle` takes one written value and returns the ACK to notify, if any.
+    Chunks are copied by offset into a buffer allocated once, and a complete
+    frame with a matching CRC is handed to `on_frame(slot, duration, pixels)`
+    outside the IRQ handler. Until that has run, new transfers get BUSY so
+    they can't overwrite the buffer being delivered.
+    """
+
+    def __init__(self, on_frame=write_slot, max_frame_bytes=MAX_FRAME_BYTES, number_of_slots=NUMBER_OF_SLOTS):
+        self.on_frame = on_frame
+        self.number_of_slots = number_of_slots
+        self.buffer = bytearray(max_frame_bytes)
+        self.view = memoryview(self.buffer)
+        self.conn_handle = None
+        self.delivering = False
+        self.completed = 0
+        self.failed = 0
+        self._reset()
+
+    def _reset(self):
+        self.conn_handle = None
+        self.slot = 0
+        self.duration = 0
+        self.length = 0
+        self.crc = 0
+        self.received = 0
+        self.chunks = 0
+        self.nacked = False
+
+    def _ack(self, status, chunk_size=0):
+        return struct.pack(_ACK, _MSG_ACK, status, self.received, _TRANSFER_WINDOW, chunk_size)
+
+    def abort(self, conn_handle):
+        """Drop a transfer whose sender disconnected."""
+        if self.conn_handle == conn_handle:
+            self._reset()
+
+    def handle(self, conn_handle, value, mtu):
+        if not value:
+            return None
+        if value[0] == _MSG_START:
+            if self.delivering or self.conn_handle not in (None, conn_handle):
+                return struct.pack(_ACK, _MSG_ACK, _STATUS_BUSY, 0, 0, 0)
+            if len(value) != _START_SIZE:
+                return struct.pack(_ACK, _MSG_ACK, _STATUS_INVALID, 0, 0, 0)
+            self._reset()
+            _, self.slot, self.duration, self.length, self.crc = struct.unpack(_START, value)
+            if self.length > len(self.buffer) or not 0 <= self.slot < self.number_of_slots:
+                self._reset()
+                return struct.pack(_ACK, _MSG_ACK, _STATUS_INVALID, 0, 0, 0)
+            self.conn_handle = conn_handle
+            return self._ack(_STATUS_OK, mtu - _ATT_HEADER_SIZE - _DATA_SIZE)
+
+        if value[0] != _MSG_DATA or conn_handle != self.conn_handle or len(value) < _DATA_SIZE:
+            return None
+        offset = struct.unpack_from(_DATA, value)[1]
+        size = len(value) - _DATA_SIZE
+        if offset > self.received:
+            # Lost a chunk: ask once for a resend from what we hold.
+            if self.nacked:
+                return None
+            self.nacked = True
+            return self._ack(_STATUS_NACK)
+        if offset < self.received or offset + size > self.length:
+            return None
+        self.view[offset:offset + size] = memoryview(value)[_DATA_SIZE:]
+        self.received += size
+        self.chunks += 1
+        self.nacked = False
+
+        if self.received < self.length:
+            return self._ack(_STATUS_OK) if self.chunks % _ACK_EVERY == 0 else None
+        if crc32(self.view[:self.length]) & 0xFFFFFFFF != self.crc:
+            self.failed += 1
+            reply = self._ack(_STATUS_CRC_ERROR)
+        else:
+            self.delivering = True
+            try:
+                micropython.schedule(self._deliver, (self.slot, self.duration, self.length))
+                self.completed += 1
+                reply = self._ack(_STATUS_DONE)
+            except RuntimeError:
+                # Schedule queue full: the sender retries the whole frame.
+                self.delivering = False
+                self.failed += 1
+                reply = self._ack(_STATUS_BUSY)
+        self.conn_handle = None
+        return reply
+
+    def _deliver(self, frame):
+        slot, duration, length = frame
+        try:
+            self.on_frame(slot, duration, self.view[:length])
+        finally:
+            self.delivering = False
+
+
+class NotifyQueue:
+    """
+    Outbound notifications for one connection.
+
+    Data is appended to the last queued notification while it still fits in
+    one ATT payload (MTU - 3), so small messages sent in quick succession go
+    out together; longer data is split across notifications.
+    """
+
+    def __init__(self, mtu=_DEFAULT_MTU):
+        self.mtu = mtu
+        self.pending = []
+        self.queued_bytes = 0
+        self.backoff_ms = 0
+        self.retry_at = 0
+        self.started = time.ticks_ms()
+        self.counters = {
+            "sent_bytes": 0,
+            "notifications": 0,
+            "merged": 0,
+            "congested": 0,
+            "dropped_bytes": 0,
+        }
+
+    def push(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        payload_size = self.mtu - _ATT_HEADER_SIZE
+        start = 0
+        if self.pending and len(self.pending[-1]) < payload_size:
+            start = payload_size - len(self.pending[-1])
+            self.pending[-1] += data[:start]
+            self.counters["merged"] += 1
+        for offset in range(start, len(data), payload_size):
+            self.pending.append(bytearray(data[offset:offset + payload_size]))
+        self.queued_bytes += len(data)
+        while self.queued_bytes > _MAX_QUEUED_BYTES:
+            dropped = self.pending.pop(0)
+            self.queued_bytes -= len(dropped)
+            self.counters["dropped_bytes"] += len(dropped)
+
+    def flush(self, notify):
+        """
+        Send queued notifications through `notify(data)` until the queue is
+        empty or the stack reports congestion; returns the number sent.
+        """
+        if self.backoff_ms and time.ticks_diff(time.ticks_ms(), self.retry_at) < 0:
+            return 0
+        sent = 0
+        while self.pending:
+            data = self.pending[0]
+            try:
+                notify(data)
+            except OSError:
+                self.counters["congested"] += 1
+                self.backoff_ms = min(max(self.backoff_ms * 2, _BACKOFF_MIN_MS), _BACKOFF_MAX_MS)
+                self.retry_at = time.ticks_add(time.ticks_ms(), self.backoff_ms)
+                break
+            self.pending.pop(0)
+            self.queued_bytes -= len(data)
+            self.counters["sent_bytes"] += len(data)
+            self.counters["notifications"] += 1
+            self.backoff_ms = 0
+            sent += 1
+        return sent
+
+    def stats(self):
+        elapsed_ms = max(time.ticks_diff(time.ticks_ms(), self.started), 1)
+        stats = dict(self.counters)
+        stats["queued_bytes"] = self.queued_bytes
+        stats["bytes_per_second"] = self.counters["sent_bytes"] * 1000 // elapsed_ms
+        return stats
+
+
 class BluetothDevice:
-    def __init__(self, ble, name="Pico"):
+    def __init__(self, ble, name="Pico", on_frame=write_slot):
         self._ble = ble
         self._ble.active(True)
+        self._ble.config(mtu=_PREFERRED_MTU)
         self._ble.irq(self._irq)
 
         ((self._handle_tx, self._handle_rx),
          (self._picoframe_characteristic, self._picoframe_descriptor,)) = self._ble.gatts_register_services(
             (_UART_SERVICE, _PICOFRAME_SERVICE), )
 
+        # Room for a whole DATA write at the preferred MTU.
+        self._ble.gatts_set_buffer(self._picoframe_characteristic, _PREFERRED_MTU - _ATT_HEADER_SIZE)
+
         self._connections = set()
+        self._queues = {}
+        self._transfer = FrameTransfer(on_frame)
         self._write_callback = None
         self._payload = advertising_payload(name=name, services=[_UART_UUID])
         self._advertise()
@@ -115,20 +339,54 @@ class BluetothDevice:
             conn_handle, _, _ = data
             print("New connection", conn_handle)
             self._connections.add(conn_handle)
+            self._queues[conn_handle] = NotifyQueue()
+            try:
+                self._ble.gattc_exchange_mtu(conn_handle)
+            except OSError:
+                pass
         elif event == _IRQ_CENTRAL_DISCONNECT:
             conn_handle, _, _ = data
             print("Disconnected", conn_handle)
             self._connections.remove(conn_handle)
+            self._queues.pop(conn_handle, None)
+            self._transfer.abort(conn_handle)
             self._advertise()
         elif event == _IRQ_GATTS_WRITE:
             conn_handle, value_handle = data
             value = self._ble.gatts_read(value_handle)
             if value_handle == self._handle_rx and self._write_callback:
                 self._write_callback(value)
+            elif value_handle == self._picoframe_characteristic:
+                queue = self._queues.get(conn_handle)
+                reply = self._transfer.handle(conn_handle, value, queue.mtu if queue else _DEFAULT_MTU)
+                if reply:
+                    try:
+                        self._ble.gatts_notify(conn_handle, self._picoframe_characteristic, reply)
+                    except OSError:
+                        # A lost ACK is recovered by the central resending its window.
+                        pass
+        elif event == _IRQ_MTU_EXCHANGED:
+            conn_handle, mtu = data
+            if conn_handle in self._queues:
+                self._queues[conn_handle].mtu = mtu
 
     def send(self, data):
-        for conn_handle in self._connections:
-            self._ble.gatts_notify(conn_handle, self._handle_tx, data)
+        """
+        Queue `data` for every connection. Nothing is sent until `flush`, so
+        messages sent between flushes are coalesced into full notifications.
+        """
+        for queue in self._queues.values():
+            queue.push(data)
+
+    def flush(self):
+        """Send queued notifications; call periodically from the main loop."""
+        for conn_handle, queue in self._queues.items():
+            if queue.pending:
+                queue.flush(lambda data: self._ble.gatts_notify(conn_handle, self._handle_tx, data))
+
+    def stats(self):
+        """Per-connection throughput and drop counters."""
+        return {conn_handle: queue.stats() for conn_handle, queue in self._queues.items()}
 
     def is_connected(self):
         return len(self._connections) > 0
@@ -160,6 +418,7 @@ def demo():
                 print("TX", data)
                 bluetooth_device.send(data)
                 i += 1
+        bluetooth_device.flush()
         time.sleep_ms(100)
 
 
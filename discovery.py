@@ -0,0 +1,99 @@
+import logging
+import select
+import socket
+import threading
+import time
+
+DISCOVERY_PORT = 14440
+DISCOVERY_PREFIX = "RaspiFrame:"
+# The cached address is refreshed this often even without a netlink event.
+ADDRESS_REFRESH_SECONDS = 30
+# rtnetlink multicast group for IPv4 address changes (linux/rtnetlink.h).
+RTMGRP_IPV4_IFADDR = 0x10
+
+logger = logging.getLogger(__name__)
+
+
+def lookup_ip_address():
+    """
+    Address of the interface that routes to the outside world. Connecting a
+    UDP socket only picks a route; no packet is sent and no process is spawned.
+    """
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        probe.connect(("10.255.255.255", 1))
+        return probe.getsockname()[0]
+    except OSError:
+        return "127.0.0.1"
+    finally:
+        probe.close()
+
+
+def open_netlink_socket():
+    """Subscribe to IPv4 address changes; returns None where netlink isn't available."""
+    if not hasattr(socket, "AF_NETLINK"):
+        return None
+    try:
+        netlink_socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        netlink_socket.bind((0, RTMGRP_IPV4_IFADDR))
+        return netlink_socket
+    except OSError as e:
+        logger.warning("Netlink unavailable, refreshing the address every %s s: %s", ADDRESS_REFRESH_SECONDS, e)
+        return None
+
+
+class DiscoveryService:
+    """
+    Answers `RaspiFrame:` UDP broadcast probes with the device address, on a
+    background thread, for as long as the server runs.
+
+    The address is looked up once and cached. It is refreshed when netlink
+    reports an IPv4 address change and, as a fallback, every
+    ADDRESS_REFRESH_SECONDS.
+    """
+
+    def __init__(self, port=DISCOVERY_PORT, refresh_seconds=ADDRESS_REFRESH_SECONDS):
+        self.port = port
+        self.refresh_seconds = refresh_seconds
+        self.ip_address = lookup_ip_address()
+        self.probes = 0
+        self._refreshed_at = time.monotonic()
+
+    def refresh(self):
+        ip_address = lookup_ip_address()
+        if ip_address != self.ip_address:
+            logger.info("Device address changed: %s -> %s", self.ip_address, ip_address)
+            self.ip_address = ip_address
+        self._refreshed_at = time.monotonic()
+
+    def handle_probe(self, data):
+        """Return the reply to one datagram, or None if it isn't a discovery probe."""
+        if not data.startswith(DISCOVERY_PREFIX.encode()):
+            return None
+        self.probes += 1
+        return f"{DISCOVERY_PREFIX}{self.ip_address}".encode()
+
+    def serve(self):
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        udp_socket.bind(("", self.port))
+        netlink_socket = open_netlink_socket()
+        sockets = [udp_socket] + ([netlink_socket] if netlink_socket else [])
+
+        logger.info("Listening for discovery broadcasts on port %s...", self.port)
+        while True:
+            timeout = max(self._refreshed_at + self.refresh_seconds - time.monotonic(), 0)
+            readable, _, _ = select.select(sockets, [], [], timeout)
+            if netlink_socket in readable:
+                netlink_socket.recv(65536)
+                self.refresh()
+            elif time.monotonic() >= self._refreshed_at + self.refresh_seconds:
+                self.refresh()
+            if udp_socket in readable:
+                data, addr = udp_socket.recvfrom(1024)
+                response = self.handle_probe(data)
+                if response:
+                    udp_socket.sendto(response, addr)
+
+    def start(self):
+        threading.Thread(target=self.serve, daemon=True).start()
@@ -0,0 +1,144 @@
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from PIL import Image
+
+RGBMATRIX_BINDINGS = os.environ.get("RGBMATRIX_BINDINGS", "/home/limonek/repos/rpi-rgb-led-matrix/bindings/python")
+
+
+class DisplayBackend:
+    """
+    Interface the renderer draws through.
+
+    A backend hands out offscreen canvases, draws PIL images into them and
+    swaps a canvas onto the panel. `swap` returns the canvas that was on the
+    panel before, which becomes the new back buffer.
+    """
+
+    width = 0
+    height = 0
+
+    def create_canvas(self):
+        raise NotImplementedError
+
+    def draw(self, canvas, image):
+        raise NotImplementedError
+
+    def draw_region(self, canvas, image, x, y):
+        """Draw `image` with its top-left corner at (x, y), leaving the rest of the canvas alone."""
+        raise NotImplementedError
+
+    def blank(self, canvas):
+        raise NotImplementedError
+
+    def swap(self, canvas):
+        raise NotImplementedError
+
+
+class RGBMatrixBackend(DisplayBackend):
+    """Drives a real HUB75 panel through the rpi-rgb-led-matrix Python bindings."""
+
+    def __init__(self, width=64, height=64, hardware_mapping='regular'):
+        if RGBMATRIX_BINDINGS not in sys.path:
+            sys.path.append(RGBMATRIX_BINDINGS)
+        from rgbmatrix import RGBMatrix, RGBMatrixOptions
+
+        options = RGBMatrixOptions()
+        options.rows = height
+        options.cols = width
+        options.chain_length = 1
+        options.parallel = 1
+        options.hardware_mapping = hardware_mapping
+        options.disable_hardware_pulsing = True
+        self.matrix = RGBMatrix(options=options)
+        self.width = width
+        self.height = height
+
+    def create_canvas(self):
+        return self.matrix.CreateFrameCanvas()
+
+    def draw(self, canvas, image):
+        canvas.SetImage(image)
+
+    def draw_region(self, canvas, image, x, y):
+        canvas.SetImage(image, x, y)
+
+    def blank(self, canvas):
+        canvas.Clear()
+
+    def swap(self, canvas):
+        return self.matrix.SwapOnVSync(canvas)
+
+
+class VirtualCanvas:
+    def __init__(self):
+        self.image = None
+
+
+class VirtualMatrixBackend(DisplayBackend):
+    """
+    In-memory panel for tests and benchmarks off-device.
+
+    Every swap, and every region drawn straight onto the visible canvas, is
+    recorded in `frames` as (monotonic timestamp, image), where image is None
+    for a blank panel. Only the last `history` updates are kept.
+    """
+
+    def __init__(self, width=64, height=64, history=1024):
+        self.width = width
+        self.height = height
+        self.frames = deque(maxlen=history)
+        self.swap_count = 0
+        self._front = VirtualCanvas()
+        self._lock = threading.Lock()
+
+    def create_canvas(self):
+        return VirtualCanvas()
+
+    def draw(self, canvas, image):
+        canvas.image = image
+
+    def draw_region(self, canvas, image, x, y):
+        if canvas.image is None:
+            canvas.image = Image.new(image.mode, (self.width, self.height))
+        else:
+            canvas.image = canvas.image.copy()
+        canvas.image.paste(image, (x, y))
+        with self._lock:
+            if canvas is self._front:
+                self.frames.append((time.monotonic(), canvas.image))
+
+    def blank(self, canvas):
+        canvas.image = None
+
+    def swap(self, canvas):
+        with self._lock:
+            previous, self._front = self._front, canvas
+            self.swap_count += 1
+            self.frames.append((time.monotonic(), canvas.image))
+            return previous
+
+    @property
+    def current_image(self):
+        """The image currently on the virtual panel, or None if it is blank."""
+        return self._front.image
+
+
+DISPLAY_BACKENDS = {
+    "rgbmatrix": RGBMatrixBackend,
+    "virtual": VirtualMatrixBackend,
+}
+
+
+def create_backend(name=None, width=64, height=64):
+    """
+    Create a display backend by name ('rgbmatrix' or 'virtual').
+    Defaults to the PICOFRAME_DISPLAY environment variable, then 'rgbmatrix'.
+    """
+    name = name or os.environ.get("PICOFRAME_DISPLAY", "rgbmatrix")
+    if name not in DISPLAY_BACKENDS:
+        raise ValueError(f"Unknown display backend: {name}")
+    return DISPLAY_BACKENDS[name](width=width, height=height)
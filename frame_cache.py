@@ -0,0 +1,95 @@
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from slot_store import iter_frames
+
+
+def decode_frame(data, size):
+    """
+    Turn packed ARGB bytes into an RGB image ready for the matrix.
+    """
+    return Image.frombytes("RGBA", size, data, "raw", "ARGB").convert("RGB")
+
+
+def decode_frames(slot_data):
+    """Decode every frame of a slot record; still images give a one-element list."""
+    size = (slot_data["width"], slot_data["height"])
+    return [decode_frame(data, size) for data in iter_frames(slot_data)]
+
+
+class FrameCache:
+    """
+    Bounded LRU cache of decoded frames, keyed by the slot CRC.
+
+    Identical pixels always have the same CRC, so a slot coming around again
+    in the rotation is served from here without any per-pixel work. Each entry
+    holds all frames of a slot, so animations play from pre-decoded images.
+    The cache keeps at most `max_entries` slots and `max_frames` decoded
+    frames in total; the most recent entry is kept even if it alone is larger.
+    """
+
+    def __init__(self, max_entries=8, max_frames=128):
+        self.max_entries = max_entries
+        self.max_frames = max_frames
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+        self._frame_count = 0
+        self._lock = threading.Lock()
+
+    def get(self, slot_data, index=0):
+        """Return one decoded frame of a slot record, decoding and caching the slot on a miss."""
+        return self.get_frames(slot_data)[index]
+
+    def get_frames(self, slot_data):
+        """Return all decoded frames of a slot record."""
+        crc = slot_data["crc"]
+        with self._lock:
+            frames = self._frames.get(crc)
+            if frames is not None:
+                self._frames.move_to_end(crc)
+                self.hits += 1
+                return frames
+            self.misses += 1
+        frames = decode_frames(slot_data)
+        self.put(crc, frames)
+        return frames
+
+    def put(self, crc, frames):
+        with self._lock:
+            self._frame_count += len(frames) - len(self._frames.get(crc, ()))
+            self._frames[crc] = frames
+            self._frames.move_to_end(crc)
+            while len(self._frames) > 1 and (len(self._frames) > self.max_entries
+                                             or self._frame_count > self.max_frames):
+                self._frame_count -= len(self._frames.popitem(last=False)[1])
+
+    def patch(self, old_crc, new_crc, region, position):
+        """
+        Derive the cached frame for a patched still slot from its old frame by
+        pasting `region` at `position`, instead of decoding the slot again.
+        Returns the new frame, or None if the old frame wasn't cached.
+        """
+        with self._lock:
+            frames = self._frames.get(old_crc)
+        if frames is None:
+            return None
+        frame = frames[0].copy()
+        frame.paste(region, position)
+        self.put(new_crc, [frame])
+        return frame
+
+    def evict(self, crc):
+        with self._lock:
+            self._frame_count -= len(self._frames.pop(crc, ()))
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._frame_count = 0
+
+    def __contains__(self, crc):
+        with self._lock:
+            return crc in self._frames
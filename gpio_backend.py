@@ -0,0 +1,169 @@
+import mmap
+import os
+import struct
+
+# BCM2835..BCM2711 GPIO register offsets within /dev/gpiomem.
+GPFSEL0 = 0x00
+GPSET0 = 0x1C
+GPCLR0 = 0x28
+GPIO_REGISTER = struct.Struct("<I")
+
+
+def mask_of(pins):
+    """Bitmask over BCM pin numbers."""
+    mask = 0
+    for pin in pins:
+        mask |= 1 << pin
+    return mask
+
+
+class GPIOBackend:
+    """
+    Interface the led_hub refresh loop writes through.
+
+    Writes are pairs of bitmasks over BCM pin numbers: pins in `set_mask` go
+    high and pins in `clear_mask` go low in one write. The refresh path is
+    compiled ahead of time, so `compile` turns a pair of masks into whatever
+    the backend writes fastest and `write` only has to emit it.
+    """
+
+    def setup(self, pins):
+        """Configure `pins` (BCM numbers) as outputs, driven low."""
+        raise NotImplementedError
+
+    def compile(self, set_mask, clear_mask):
+        return set_mask, clear_mask
+
+    def write(self, op):
+        raise NotImplementedError
+
+
+class RPiGPIOBackend(GPIOBackend):
+    """Multi-pin writes through RPi.GPIO: one output() call with a list of channels per write."""
+
+    def __init__(self, gpio=None):
+        if gpio is None:
+            import RPi.GPIO as gpio
+        self.gpio = gpio
+        self.pins = []
+
+    def setup(self, pins):
+        self.pins = sorted(pins)
+        self.gpio.setwarnings(False)
+        self.gpio.setmode(self.gpio.BCM)
+        for pin in self.pins:
+            self.gpio.setup(pin, self.gpio.OUT, initial=0)
+
+    def compile(self, set_mask, clear_mask):
+        channels = [pin for pin in self.pins if (set_mask | clear_mask) >> pin & 1]
+        values = [1 if set_mask >> pin & 1 else 0 for pin in channels]
+        return channels, values
+
+    def write(self, op):
+        self.gpio.output(*op)
+
+
+class RegisterGPIOBackend(GPIOBackend):
+    """
+    Writes masks straight into the GPSET0/GPCLR0 registers through /dev/gpiomem,
+    two stores per write whatever the number of pins. Only for Pis up to the
+    Pi 4; the Pi 5 moved GPIO behind the RP1 and has no such registers.
+    """
+
+    def __init__(self, device="/dev/gpiomem"):
+        fd = os.open(device, os.O_RDWR | os.O_SYNC)
+        try:
+            self.mem = mmap.mmap(fd, 4096, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+
+    def setup(self, pins):
+        for pin in pins:
+            offset = GPFSEL0 + 4 * (pin // 10)
+            shift = 3 * (pin % 10)
+            value = GPIO_REGISTER.unpack_from(self.mem, offset)[0]
+            GPIO_REGISTER.pack_into(self.mem, offset, value & ~(0b111 << shift) | (0b001 << shift))
+        GPIO_REGISTER.pack_into(self.mem, GPCLR0, mask_of(pins))
+
+    def compile(self, set_mask, clear_mask):
+        return GPIO_REGISTER.pack(set_mask), GPIO_REGISTER.pack(clear_mask)
+
+    def write(self, op):
+        set_word, clear_word = op
+        self.mem[GPCLR0:GPCLR0 + 4] = clear_word
+        self.mem[GPSET0:GPSET0 + 4] = set_word
+
+
+class RecordingGPIOBackend(GPIOBackend):
+    """
+    Fake backend for tests and benchmarks off-device. Keeps the current level
+    of every pin as a bitmask in `levels`, counts writes, and when `record` is
+    set appends each write's resulting levels to `history`.
+    """
+
+    def __init__(self, record=False):
+        self.levels = 0
+        self.writes = 0
+        self.record = record
+        self.history = []
+
+    def setup(self, pins):
+        self.levels &= ~mask_of(pins)
+
+    def write(self, op):
+        set_mask, clear_mask = op
+        self.levels = self.levels & ~clear_mask | set_mask
+        self.writes += 1
+        if self.record:
+            self.history.append(self.levels)
+
+    def level(self, pin):
+        return self.levels >> pin & 1
+
+
+class MockGPIO:
+    """
+    Stand-in for the RPi.GPIO module, so RPiGPIOBackend can run off-device.
+    Counts output() calls and keeps the last level written to each pin.
+    """
+    BCM = 11
+    OUT = 0
+
+    def __init__(self):
+        self.writes = 0
+        self.levels = {}
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, mode, initial=0):
+        self.levels[pin] = initial
+
+    def output(self, pin, value):
+        self.writes += 1
+        if isinstance(pin, (list, tuple)):
+            for channel, level in zip(pin, value):
+                self.levels[channel] = 1 if level else 0
+        else:
+            self.levels[pin] = 1 if value else 0
+
+
+GPIO_BACKENDS = {
+    "rpi": RPiGPIOBackend,
+    "register": RegisterGPIOBackend,
+    "recording": RecordingGPIOBackend,
+}
+
+
+def create_gpio_backend(name=None):
+    """
+    Create a GPIO backend by name ('rpi', 'register' or 'recording').
+    Defaults to the PICOFRAME_GPIO environment variable, then 'rpi'.
+    """
+    name = name or os.environ.get("PICOFRAME_GPIO", "rpi")
+    if name not in GPIO_BACKENDS:
+        raise ValueError(f"Unknown GPIO backend: {name}")
+    return GPIO_BACKENDS[name]()
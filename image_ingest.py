@@ -0,0 +1,102 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image, ImageOps, ImageSequence
+
+# Delay used for GIF frames that don't specify one, in seconds.
+DEFAULT_GIF_DELAY = 0.1
+# Largest image decoded, after JPEG draft scaling. Pillow only warns below
+# about 179 MP, far more than a 512 MB Pi Zero can hold decoded.
+MAX_DECODED_PIXELS = 4096 * 4096
+
+
+def image_to_argb(image):
+    """
+    Pack an image into opaque big-endian ARGB words, the slot pixel format.
+    """
+    r, g, b = image.convert("RGB").split()
+    alpha = Image.new("L", image.size, 255)
+    return Image.merge("RGBA", (alpha, r, g, b)).tobytes()
+
+
+def fit_to_panel(image, width, height):
+    """Scale and center-crop an image so it exactly covers the panel."""
+    return ImageOps.fit(image.convert("RGB"), (width, height), Image.LANCZOS)
+
+
+def decode_upload(raw, width, height, max_frames=64, draft=True):
+    """
+    Decode an encoded JPEG, PNG or GIF into panel-sized frames.
+
+    JPEGs are decoded in draft mode, letting libjpeg downscale by up to 8x
+    while decoding, which is far cheaper than decoding at full size and
+    resizing afterwards. Stills are turned upright per their EXIF
+    orientation. Animated GIFs keep their frames and delays.
+
+    Args:
+        raw (bytes): The encoded image file.
+        width, height (int): Panel size.
+        max_frames (int): Frames beyond this are dropped.
+        draft (bool): Use JPEG draft mode; only turned off for benchmarking.
+
+    Returns:
+        tuple: (list of packed ARGB frames, list of per-frame delays or None).
+
+    Raises:
+        ValueError: If the data isn't an image Pillow can read, or would
+            decode to more than MAX_DECODED_PIXELS.
+    """
+    try:
+        image = Image.open(BytesIO(raw))
+        if image.format == "JPEG" and draft:
+            image.draft("RGB", (width, height))
+        # Only the header has been read so far; check before decoding anything.
+        if image.size[0] * image.size[1] > MAX_DECODED_PIXELS:
+            raise ValueError(f"Image too large: {image.size[0]}x{image.size[1]} pixels")
+        if not getattr(image, "is_animated", False):
+            image = ImageOps.exif_transpose(image)
+            return [image_to_argb(fit_to_panel(image, width, height))], None
+
+        frames = []
+        delays = []
+        for frame in ImageSequence.Iterator(image):
+            if len(frames) >= max_frames:
+                break
+            frames.append(image_to_argb(fit_to_panel(frame, width, height)))
+            delays.append(frame.info.get("duration", 0) / 1000 or DEFAULT_GIF_DELAY)
+        return frames, delays
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Unsupported image file: {e}")
+
+
+class IngestCache:
+    """
+    Small LRU of decoded uploads keyed by the SHA-256 of the encoded file,
+    so uploading the same photo again skips decoding and resizing.
+    """
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def decode(self, raw, width, height, max_frames=64):
+        """Same as decode_upload, served from the cache when the file was seen before."""
+        key = (hashlib.sha256(raw).hexdigest(), width, height, max_frames)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        entry = decode_upload(raw, width, height, max_frames)
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
@@ -1,11 +1,28 @@
 import time
 import random
-import pygame
-import RPi.GPIO
+
+try:
+    import pygame
+except ImportError:
+    pygame = None
+
+from gpio_backend import create_gpio_backend, mask_of
+
+
+# Bits of a pre-combined pin state byte, one per colour line of the HUB75 connector.
+R1_BIT, G1_BIT, B1_BIT = 0x01, 0x02, 0x04
+R2_BIT, G2_BIT, B2_BIT = 0x08, 0x10, 0x20
+
+
+def read_pixel(Image, Col, Row):
+    """Read an (r, g, b, ...) pixel from a pygame Surface or a PIL Image."""
+    if hasattr(Image, 'get_at'):
+        return Image.get_at((Col, Row))
+    return Image.getpixel((Col, Row))
 
 
 class LEDMatrix:
-    def __init__(self):
+    def __init__(self, backend=None, frame_images=None, bit_depth=1):
         # GPIO pin assignments.
         self.pins = {
             'R1': 14, 'G1': 15, 'B1': 18,
@@ -20,74 +37,121 @@ class LEDMatrix:
         self.DISPLAY_FRAMES = 4
         self.DISPLAY_COLS = 64
         self.DISPLAY_ROWS = 64
-
-        # PyGame used to read image files from storage.
-        pygame.init()
+        # Bits per colour channel, shown with binary-coded modulation:
+        # bit plane n is refreshed 2**n times per frame.
+        self.BIT_DEPTH = bit_depth
 
         # Configure GPIO pins.
-        RPi.GPIO.setwarnings(False)
-        RPi.GPIO.setmode(RPi.GPIO.BCM)
-        for pin in self.pins.values():
-            RPi.GPIO.setup(pin, RPi.GPIO.OUT, initial=0)
-
-        # Load animation image files.
-        self.FrameImage = []
-        for i in range(1, self.DISPLAY_FRAMES + 1):
-            self.FrameImage.append(pygame.image.load(f"sample{i}.png"))
-
-        # Load a display frames from images.
+        self.backend = backend or create_gpio_backend()
+        self.backend.setup(self.pins.values())
+
+        # Load animation image files. PyGame used to read image files from storage.
+        if frame_images is None:
+            pygame.init()
+            frame_images = [pygame.image.load(f"sample{i}.png") for i in range(1, self.DISPLAY_FRAMES + 1)]
+        self.FrameImage = frame_images
+        self.DISPLAY_FRAMES = len(self.FrameImage)
+
+        # Precompute display frames as bit planes.
+        self.PlaneSchedule = [Plane for Plane in range(self.BIT_DEPTH) for _ in range(1 << Plane)]
         self.DisplayImage = self.load_display_frames()
+        self.RefreshSequence = self.compile_refresh_sequences()
 
     def load_display_frames(self):
+        """
+        Precompute every frame into bit planes.
+
+        DisplayImage[Frame][Plane] is a flat bytes buffer with one pre-combined
+        pin state byte (R1_BIT..B2_BIT) per column, row pair after row pair, in
+        the order the refresh loop clocks them out. The loop then just walks it.
+        """
+        HalfRows = self.DISPLAY_ROWS // 2
+        Shift = 8 - self.BIT_DEPTH
         DisplayImage = []
         for Frame in range(self.DISPLAY_FRAMES):
-            DisplayImage.append([])
-            for Row in range(self.DISPLAY_ROWS):
-                DisplayImage[Frame].append([])
+            Planes = [bytearray(HalfRows * self.DISPLAY_COLS) for _ in range(self.BIT_DEPTH)]
+            for Row in range(HalfRows):
+                # Data clocked in while row address Row is selected is shown on the next row.
+                SelRow = Row + 1
+                if SelRow > HalfRows - 1:
+                    SelRow = 0
                 for Col in range(self.DISPLAY_COLS):
-                    DisplayImage[Frame][Row].append([])
-                    ColourValue = self.FrameImage[Frame].get_at((Col, Row))
-                    DisplayImage[Frame][Row][Col].append(ColourValue[0] & 0x80)
-                    DisplayImage[Frame][Row][Col].append(ColourValue[1] & 0x80)
-                    DisplayImage[Frame][Row][Col].append(ColourValue[2] & 0x80)
+                    Top = read_pixel(self.FrameImage[Frame], Col, SelRow)
+                    Bottom = read_pixel(self.FrameImage[Frame], Col, SelRow + HalfRows)
+                    Top = [Top[Colour] >> Shift for Colour in self.colors.values()]
+                    Bottom = [Bottom[Colour] >> Shift for Colour in self.colors.values()]
+                    Index = Row * self.DISPLAY_COLS + Col
+                    for Plane in range(self.BIT_DEPTH):
+                        Bit = 1 << Plane
+                        Planes[Plane][Index] = (
+                            (R1_BIT if Top[0] & Bit else 0) | (G1_BIT if Top[1] & Bit else 0) |
+                            (B1_BIT if Top[2] & Bit else 0) | (R2_BIT if Bottom[0] & Bit else 0) |
+                            (G2_BIT if Bottom[1] & Bit else 0) | (B2_BIT if Bottom[2] & Bit else 0)
+                        )
+            DisplayImage.append([bytes(Plane) for Plane in Planes])
         return DisplayImage
 
+    def compile_refresh_sequences(self):
+        """
+        Compile every bit plane into the backend writes that clock it out.
+
+        RefreshSequence[Frame][Plane] is a flat list of compiled set/clear mask
+        pairs over BCM pins. Per row pair: select the row address, then two
+        writes per column (colour bits with OE and CLK low, which also shows
+        the latched row, then CLK and OE high to clock the bits in while
+        blanking), then pulse LAT. Identical writes share one compiled op.
+        """
+        pins = self.pins
+        ColourPins = [pins['R1'], pins['G1'], pins['B1'], pins['R2'], pins['G2'], pins['B2']]
+        ColourMasks = [1 << Pin for Pin in ColourPins]
+        AllColours = mask_of(ColourPins)
+        AddressPins = [pins['A'], pins['B'], pins['C'], pins['D']]
+        AllAddress = mask_of(AddressPins)
+        Clock, Enable, Latch = 1 << pins['CLK'], 1 << pins['OE'], 1 << pins['LAT']
+
+        Compiled = {}
+
+        def op(SetMask, ClearMask):
+            Key = (SetMask, ClearMask)
+            if Key not in Compiled:
+                Compiled[Key] = self.backend.compile(SetMask, ClearMask)
+            return Compiled[Key]
+
+        ClockIn = op(Clock | Enable, 0)
+        LatchOn = op(Latch, Clock)
+        LatchOff = op(0, Latch)
+        ColumnOps = []
+        for State in range(64):
+            SetMask = 0
+            for Bit, Mask in enumerate(ColourMasks):
+                if State >> Bit & 1:
+                    SetMask |= Mask
+            ColumnOps.append(op(SetMask, AllColours & ~SetMask | Enable | Clock))
+
+        RefreshSequence = []
+        for Planes in self.DisplayImage:
+            FrameSequence = []
+            for Buffer in Planes:
+                Sequence = []
+                for Row in range(self.DISPLAY_ROWS // 2):
+                    # Select row to display.
+                    Address = mask_of(Pin for Bit, Pin in enumerate(AddressPins) if Row >> Bit & 1)
+                    Sequence.append(op(Address, AllAddress & ~Address))
+                    for State in Buffer[Row * self.DISPLAY_COLS:(Row + 1) * self.DISPLAY_COLS]:
+                        Sequence.append(ColumnOps[State])
+                        Sequence.append(ClockIn)
+                    # Latch the row pair into the output buffer.
+                    Sequence.append(LatchOn)
+                    Sequence.append(LatchOff)
+                FrameSequence.append(Sequence)
+            RefreshSequence.append(FrameSequence)
+        return RefreshSequence
+
     def update_led_matrix(self, Frame):
-        for Row in range(self.DISPLAY_ROWS // 2):
-            # Select row to display.
-            RPi.GPIO.output(self.pins['A'], Row & 1)
-            RPi.GPIO.output(self.pins['B'], Row & 2)
-            RPi.GPIO.output(self.pins['C'], Row & 4)
-            RPi.GPIO.output(self.pins['D'], Row & 8)
-
-            SelRow = Row + 1
-            if SelRow > (self.DISPLAY_ROWS // 2) - 1:
-                SelRow = 0
-            for Col in range(self.DISPLAY_COLS):
-                # Load bits into top row set.
-                RPi.GPIO.output(self.pins['R1'], self.DisplayImage[Frame][SelRow][Col][self.colors['RED']])
-                RPi.GPIO.output(self.pins['G1'], self.DisplayImage[Frame][SelRow][Col][self.colors['GREEN']])
-                RPi.GPIO.output(self.pins['B1'], self.DisplayImage[Frame][SelRow][Col][self.colors['BLUE']])
-
-                # Load bits into bottom row set.
-                RPi.GPIO.output(self.pins['R2'],
-                                self.DisplayImage[Frame][SelRow + self.DISPLAY_ROWS // 2][Col][self.colors['RED']])
-                RPi.GPIO.output(self.pins['G2'],
-                                self.DisplayImage[Frame][SelRow + self.DISPLAY_ROWS // 2][Col][self.colors['GREEN']])
-                RPi.GPIO.output(self.pins['B2'],
-                                self.DisplayImage[Frame][SelRow + self.DISPLAY_ROWS // 2][Col][self.colors['BLUE']])
-
-                # While clocking in new bit data.
-                # Refresh existing display data on the current output row.
-                RPi.GPIO.output(self.pins['OE'], 0)
-                RPi.GPIO.output(self.pins['CLK'], 1)
-                RPi.GPIO.output(self.pins['OE'], 1)
-                RPi.GPIO.output(self.pins['CLK'], 0)
-
-            # When a pair of rows of display bits has been loaded.
-            # Latch the data into the output buffer.
-            RPi.GPIO.output(self.pins['LAT'], 1)
-            RPi.GPIO.output(self.pins['LAT'], 0)
+        write = self.backend.write
+        for Plane in self.PlaneSchedule:
+            for Op in self.RefreshSequence[Frame][Plane]:
+                write(Op)
 
     def run(self):
         # Loop forever.
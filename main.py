@@ -1,6 +1,5 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from pathlib import Path
-import socket
 import threading
 import os
 import time
@@ -9,30 +8,106 @@ import gc
 import psutil
 import zlib
 import json
-import sys
-sys.path.append("/home/limonek/repos/rpi-rgb-led-matrix/bindings/python")
-from rgbmatrix import RGBMatrix, RGBMatrixOptions
-from PIL import Image
+import gzip
+import logging
+from slot_store import SlotStore, pack_pixels, unpack_pixels, make_slot, frames_crc, delays_crc, iter_frames
+from frame_cache import FrameCache, decode_frame
+from renderer import FrameRenderer
+from display_backend import create_backend
+from render_jobs import RenderQueue, POLICY_QUEUE, POLICY_PREEMPT
+from scheduler import SlotScheduler, DEFAULT_FRAME_DELAY, MAX_SLOT_DURATION
+from image_ingest import IngestCache
+from stream_server import StreamReceiver
+from discovery import DiscoveryService
+from metrics import REGISTRY, CONTENT_TYPE
 
 app = Flask(__name__)
-
-SLOTS_FILE = "slots_data.json"
-slots = {}
+# Bodies past this get 413 before they are read; the largest legitimate one
+# is a JSON batch of six 64-frame animations (about 17 MB).
+app.config["MAX_CONTENT_LENGTH"] = 32 * 1024 * 1024
+logger = logging.getLogger(__name__)
+
+WIDTH = 64
+HEIGHT = 64
+IMAGE_UPLOAD_HEADER = struct.Struct("!ifI")  # slot, duration, crc
+IMAGE_PATCH_HEADER = struct.Struct("!iHHHHI")  # slot, x, y, width, height, crc
+UPLOAD_DISPLAY_SECONDS = 5
+MAX_ANIMATION_FRAMES = 64
+GZIP_LEVEL = 5
+
+slot_store = SlotStore()
+# Room for every slot, and for two full-length animations (the one on the
+# panel and the next one being prepared) worth of decoded frames.
+frame_cache = FrameCache(max_entries=slot_store.number_of_slots + 2, max_frames=2 * MAX_ANIMATION_FRAMES)
 matrix = None
-current_image = None
-image_lock = threading.Lock()
-interrupt_event = threading.Event()
-
-def initialize_matrix():
-    global matrix
-    options = RGBMatrixOptions()
-    options.rows = 64
-    options.cols = 64
-    options.chain_length = 1
-    options.parallel = 1
-    options.hardware_mapping = 'regular'
-    options.disable_hardware_pulsing = True
-    matrix = RGBMatrix(options=options)
+renderer = None
+render_queue = RenderQueue()
+ingest_cache = IngestCache()
+stream_receiver = StreamReceiver(render_queue, WIDTH, HEIGHT)
+discovery_service = DiscoveryService()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "picoframe_http_request_duration_seconds",
+    "HTTP request latency by method, route and status.",
+    labelnames=("method", "route", "status"))
+UPLOAD_STAGE_SECONDS = REGISTRY.histogram(
+    "picoframe_upload_stage_seconds",
+    "Time spent per image upload in each stage: parse (JSON), decode (image files), crc and persist.",
+    labelnames=("stage",))
+
+
+def cache_counts(attribute):
+    return {("frame",): getattr(frame_cache, attribute), ("ingest",): getattr(ingest_cache, attribute)}
+
+
+def cache_hit_ratios():
+    ratios = {}
+    for name, cache in (("frame", frame_cache), ("ingest", ingest_cache)):
+        lookups = cache.hits + cache.misses
+        ratios[(name,)] = cache.hits / lookups if lookups else 0.0
+    return ratios
+
+
+REGISTRY.counter_callback("picoframe_cache_hits_total", "Hits in the decoded frame (frame) and image file (ingest) caches.",
+                          lambda: cache_counts("hits"), labelnames=("cache",))
+REGISTRY.counter_callback("picoframe_cache_misses_total", "Misses in the decoded frame (frame) and image file (ingest) caches.",
+                          lambda: cache_counts("misses"), labelnames=("cache",))
+REGISTRY.gauge_callback("picoframe_cache_hit_ratio", "Share of cache lookups served without decoding.",
+                        cache_hit_ratios, labelnames=("cache",))
+REGISTRY.counter_callback("picoframe_stream_frames_total", "Live stream frames by outcome.",
+                          lambda: {(outcome,): count for outcome, count in stream_receiver.counters.items()},
+                          labelnames=("outcome",))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.before_request
+def reject_oversized_body():
+    """Answer 413 up front; the handlers' broad except would turn Flask's own 413 into a 400."""
+    if request.content_length and request.content_length > app.config["MAX_CONTENT_LENGTH"]:
+        return jsonify({"status": "error", "message": "Payload too large"}), 413
+
+
+@app.after_request
+def observe_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method,
+                                route=route, status=response.status_code)
+    return response
+
+
+def initialize_matrix(backend=None):
+    """
+    Create the display backend and the renderer drawing into it.
+    `backend` is 'rgbmatrix' or 'virtual'; see display_backend.create_backend.
+    """
+    global matrix, renderer
+    matrix = create_backend(backend, WIDTH, HEIGHT)
+    renderer = FrameRenderer(matrix, frame_cache)
 
 
 @app.route("/system", methods=["POST"])
@@ -42,7 +117,7 @@ def system_action():
     """
     try:
         data = request.get_json()
-        print(f"data: {data}")
+        logger.debug("System action request: %s", data)
         action = data.get("action", "").lower()
 
         if action == "getfreemem":
@@ -86,83 +161,36 @@ def system_action():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-def initialize_slots(file_path="slots_data.json", number_of_slots=6):
-    """
-    Initialize the slots.json file with None values for all slots if it's empty or invalid.
-    """
-    try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            if "slots" in data and isinstance(data["slots"], dict):
-                print("Slots file is already initialized.")
-                return  
-    except (FileNotFoundError, json.JSONDecodeError):
-        print("Slots file not found or invalid. Initializing with default slots.")
-
-    default_slots = {str(i): None for i in range(number_of_slots)}
-
-    with open(file_path, 'w') as f:
-        json.dump({"slots": default_slots}, f, indent=4)
-
-    print("Slots file has been initialized.")
-
-
-def load_slots():
-    """Load slots data from the JSON file."""
-    number_of_slots = 6
-    try:
-        with open(SLOTS_FILE, 'r') as f:
-            data = json.load(f)
-            slots = data.get("slots", {})
-            return slots
-    except (FileNotFoundError, json.JSONDecodeError):
-        print("Slots file not found or invalid")
-        return slots
-    
-
-def save_slot(slot_number, slot_data, file_path="slots_data.json"):
-    """
-    Update a specific slot's value in the slots.json file.
-    
-    Args:
-        slot_number (int): The slot number to update.
-        slot_data (dict or None): The data to assign to the slot (e.g., image details or None).
-        file_path (str): Path to the slots.json file.
-    """
-    try:
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-
-        if "slots" not in data or not isinstance(data["slots"], dict):
-            print("Invalid slots.json structure.")
-
-        data["slots"][str(slot_number)] = slot_data
-        print(f"Slot {slot_number} updated with data: {slot_data}")
-
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=4)
-            print("Slots successfully saved.")
-
-    except (FileNotFoundError, json.JSONDecodeError):
-        print("Slots file not found or invalid.")
-    except Exception as e:
-        print(f"Failed to update slot {slot_number}: {e}")
-
-
 @app.route("/slots", methods=["GET"])
 def get_slots():
     """
     Endpoint to list all slots and their statuses.
+    With `?metadata=true` only slot metadata is returned, no pixels.
     """
-    print(f"Request: {request}")
-    data = request.args
-    slots = load_slots()
-    print(f"slots: {slots}")
-    print(f"len(slots):{len(slots)}")
+    metadata_only = request.args.get("metadata", "").lower() in ("1", "true", "yes")
+    slots = slot_store.load()
 
     busy_slots = [key for key,value in slots.items() if value is not None]
-    print(f"busy_slots: {busy_slots}")
-    return jsonify({"slots": slots}), 200
+    logger.debug("busy_slots: %s", busy_slots)
+
+    listing_crc = zlib.crc32(json.dumps({key: slot_metadata(value) for key, value in slots.items()}).encode())
+    etag = f"{'meta' if metadata_only else 'slots'}-{listing_crc:08x}"
+    if metadata_only:
+        return conditional_response(etag, lambda: jsonify(
+            {"slots": {key: slot_metadata(value) for key, value in slots.items()}}))
+    return conditional_response(etag, lambda: jsonify(
+        {"slots": {key: slot_to_json(value) for key, value in slots.items()}}), compress=True)
+
+@app.route("/slots/manifest", methods=["GET"])
+def get_manifest():
+    """
+    Endpoint returning {slot: {crc, duration, generation}} for every slot, plus
+    the store generation, so clients can upload only the slots that differ.
+    """
+    manifest = slot_store.manifest()
+    etag = f"manifest-{zlib.crc32(json.dumps(manifest, sort_keys=True).encode()):08x}"
+    return conditional_response(etag, lambda: jsonify(manifest))
+
 
 @app.route("/slots/clear", methods=["POST"])
 def clear_slot():
@@ -175,12 +203,15 @@ def clear_slot():
             return jsonify({"status": "error", "message": "Missing 'slot' parameter"}), 400
 
         slot = str(data["slot"])
-        slots = load_slots()
+        slots = slot_store.load()
 
         if slot not in slots:
             return jsonify({"status": "error", "message": f"Slot {slot} does not exist"}), 400
 
-        save_slot(slot, None)
+        old_slot_data = slots[slot]
+        slot_store.save_slot(slot, None)
+        release_frame(old_slot_data)
+        render_queue.notify_slots_changed()
         return jsonify({"status": "success", "message": f"Slot {slot} cleared"}), 200
 
     except Exception as e:
@@ -188,68 +219,14 @@ def clear_slot():
 
 
 def slot_display_loop():
-    global current_image
-    current_slot_index = 0
-    slots_keys = []
-    def responsive_sleep(duration):
-        """Sleep in small increments to allow interrupt checks."""
-        elapsed = 0
-        increment = 0.1  
-        while elapsed < duration:
-            if interrupt_event.is_set():
-                print("Interrupt detected during responsive_sleep.")
-                return 
-            time.sleep(increment)
-            elapsed += increment
-
-    while True:
-        if interrupt_event.is_set():
-            print("Entered interrupt event in slot display loop")
-            print(f"current_image before entering image_lock: {current_image}")
-            with image_lock:
-                print("Entered image_lock")
-                if current_image:
-                    print(f"Displaying current image for 5 seconds:")
-                    display_image(current_image['pixels'])
-                    time.sleep(5)
-                    matrix.Clear()
-                    current_image = None
-                    interrupt_event.clear()
-                    print("Resuming normal slot cycle")
-                    continue
-            
-        slots = load_slots()
-        if not slots:
-            print("No slots found. Waiting...")
-            responsive_sleep(5)
-            continue
-        
-        if not slots_keys or set(slots_keys) != set(slots.keys()):
-            slots_keys = list(slots.keys())
-            current_slot_index = 0
-            
-        for _ in range(len(slots_keys)):
-            slot = slots_keys[current_slot_index]
-            slot_data = slots.get(slot)
-            
-            if interrupt_event.is_set():
-                print("Interrupt signal received, breaking out of slot display loop")
-                break
-            
-            if slot_data:  
-                duration = slot_data.get("duration", 10)
-                pixels = slot_data.get("pixels", [])
-                if pixels:
-                    print(f"Displaying image from slot {slot} for {duration} seconds.")
-                    display_image(pixels)
-                    responsive_sleep(duration)  
-                    matrix.Clear()
-                else:
-                    print(f"Slot {slot} has no valid pixel data.")
-            else:
-                print(f"Slot {slot} is empty.")
-            current_slot_index = (current_slot_index + 1) % len(slots_keys)
-        responsive_sleep(1)
+    """
+    Render loop: shows queued render jobs and otherwise rotates through the slots.
+    This is the only thread that draws on the matrix.
+    """
+    if not renderer:
+        logger.error("Matrix not initialized.")
+        return
+    SlotScheduler(slot_store, render_queue, renderer).run()
 
 
 def calculate_crc(image):
@@ -257,17 +234,19 @@ def calculate_crc(image):
     Calculates the CRC32 of the given image data.
     This replicates the behavior of the Java CRC calculation.
     
+    The whole list is packed into big-endian signed 32-bit words in one step
+    and hashed with a single zlib.crc32 call.
+
     Args:
-        image (list of int): The image data as a list of integers (e.g., ARGB values).
+        image (list of int or bytes): The image data as a list of integers (e.g., ARGB values),
+            or pixels already packed with `pack_pixels`.
 
     Returns:
         int: The calculated CRC32 value.
     """
-    byte_data = bytearray()
-    for value in image:
-        byte_data.extend(value.to_bytes(4, byteorder='big', signed=True))
-    
-    crc32_value = zlib.crc32(byte_data) & 0xFFFFFFFF  
+    if not isinstance(image, (bytes, bytearray, memoryview)):
+        image = pack_pixels(image)
+    crc32_value = zlib.crc32(image) & 0xFFFFFFFF
     return crc32_value
 
 
@@ -275,84 +254,422 @@ def calculate_crc(image):
 def set_image():
     """
     Endpoint to upload image data to a specific slot.
-    Expects JSON payload with keys: slot, duration, pixels.
+    Expects JSON payload with keys: slot, duration, pixels, crc,
+    or an application/octet-stream body (see `set_image_binary`).
+    Animated slots send `frames` instead of `pixels`: a list of
+    {"pixels": [...], "delay": seconds}, with crc over all frames in order.
+    Encoded image files are accepted too (see `set_image_file`).
     """
-    global current_image
+    if request.mimetype == "application/octet-stream":
+        return set_image_binary()
+    if request.mimetype.startswith("image/") or "file" in request.files:
+        return set_image_file()
     try:
-        data = request.get_json()
-        print(f"image_data: {data}")
-        if not data:
-            return jsonify({"status": "error", "message": "Invalid payload"}), 400
+        with UPLOAD_STAGE_SECONDS.time(stage="parse"):
+            data = request.get_json()
+            if not data:
+                return jsonify({"status": "error", "message": "Invalid payload"}), 400
+            slot, duration, received_crc, frames, delays = parse_image_json(data)
+        logger.debug("Image upload for slot %s: %s frame(s), crc %s", slot, len(frames), received_crc)
+        return store_image(slot, duration, received_crc, frames, delays)
 
-        if "slot" not in data:
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+
+def parse_slot(slot):
+    """
+    Validate a client-supplied slot number.
+
+    Returns:
+        str: The slot key used by the slot store.
+
+    Raises:
+        ValueError: Unless the slot is an integer from 0 to number_of_slots - 1.
+    """
+    if isinstance(slot, str) and slot.isascii() and slot.isdigit():
+        slot = int(slot)
+    if isinstance(slot, bool) or not isinstance(slot, int) or not 0 <= slot < slot_store.number_of_slots:
+        raise ValueError(f"Invalid slot, expected 0 to {slot_store.number_of_slots - 1}")
+    return str(slot)
+
+
+def parse_duration(value, name="duration"):
+    """
+    Validate a duration or frame delay in seconds.
+
+    Raises:
+        ValueError: Unless the value is a finite number above 0 and at most MAX_SLOT_DURATION.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 < value <= MAX_SLOT_DURATION:
+        raise ValueError(f"Invalid {name}, expected more than 0 and at most {MAX_SLOT_DURATION} seconds")
+    return value
+
+
+def parse_image_json(data):
+    """
+    Validate one JSON image upload and pack its frames.
+
+    Returns:
+        tuple: (slot, duration, crc, list of packed frames, list of delays).
+
+    Raises:
+        ValueError: If a key is missing or a frame has the wrong number of pixels.
+    """
+    for key in ("slot", "duration", "crc"):
+        if key not in data:
+            raise ValueError(f"Invalid payload, {key} not in data")
+    if "pixels" not in data and "frames" not in data:
+        raise ValueError("Invalid payload, pixels not in data")
+
+    frames_data = data["frames"] if "frames" in data else [{"pixels": data["pixels"]}]
+    if not isinstance(frames_data, list) or not 1 <= len(frames_data) <= MAX_ANIMATION_FRAMES:
+        raise ValueError(f"Invalid payload, expected 1 to {MAX_ANIMATION_FRAMES} frames")
+    frames = []
+    delays = []
+    for frame in frames_data:
+        pixels = frame.get("pixels", [])
+        if len(pixels) != WIDTH * HEIGHT:
+            raise ValueError(f"Invalid payload, expected {WIDTH * HEIGHT} pixels")
+        frames.append(pack_pixels(pixels))
+        delays.append(parse_duration(float(frame.get("delay", DEFAULT_FRAME_DELAY)), "delay"))
+    return data["slot"], parse_duration(data["duration"]), data["crc"], frames, delays
+
+
+def set_image_binary():
+    """
+    Binary variant of the /image upload.
+    The body is an IMAGE_UPLOAD_HEADER (slot, duration, crc, all big-endian)
+    followed by WIDTH*HEIGHT big-endian ARGB words, the same framing the Pico
+    receiver uses. The pixels are checksummed and stored as raw bytes.
+    """
+    try:
+        body = request.get_data()
+        expected_size = IMAGE_UPLOAD_HEADER.size + WIDTH * HEIGHT * 4
+        if len(body) != expected_size:
+            return jsonify({"status": "error", "message": f"Invalid payload, expected {expected_size} bytes"}), 400
+
+        slot, duration, received_crc = IMAGE_UPLOAD_HEADER.unpack_from(body)
+        if duration.is_integer():
+            duration = int(duration)
+        return store_image(slot, duration, received_crc, [body[IMAGE_UPLOAD_HEADER.size:]])
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+
+def set_image_file():
+    """
+    Encoded-image variant of the /image upload.
+    The body is a JPEG, PNG or GIF file, or a multipart form with a `file` field.
+    `slot`, `duration` and an optional `crc` of the file come from the query
+    string or form. The image is decoded, scaled and cropped to the panel on
+    the server; an animated GIF becomes an animated slot.
+    """
+    try:
+        slot = request.values.get("slot", type=str)
+        if slot is None:
             return jsonify({"status": "error", "message": "Invalid payload, slot not in data"}), 400
-        if "duration" not in data:
-            return jsonify({"status": "error", "message": "Invalid payload, duration not in data"}), 400
-        if "pixels" not in data:
-            return jsonify({"status": "error", "message": "Invalid payload, pixels not in data"}), 400
-        if "crc" not in data:
-            return jsonify({"status": "error", "message": "Invalid payload, crc not in data"}), 400
-
-        slot = data['slot']
-        duration = data['duration']
-        pixels = data['pixels']
-        received_crc = data["crc"]
-        
-        calculated_crc = calculate_crc(pixels)
-        if calculated_crc != received_crc:
-            return jsonify({"message": "CRC mismatch", "expected_crc": calculated_crc, "status": "error"}), 400
-
-        slots = load_slots()
-        print(f"Current slots before update: {slots}")
-        slots[slot] = {"duration": duration, "pixels": pixels, "crc": received_crc}
-        save_slot(slot, slots[slot])
-        print(f"Updated slots after setting image: {slots}")
-        
-        with image_lock:
-            current_image = {"pixels": pixels, "duration": duration, "crc":received_crc}
-            interrupt_event.set()
-            print("Temporary image set for display")
-            print(f"Current_image: {current_image}")
-        return jsonify({"status": "success","crc": calculated_crc, "slot": slot}), 200
+        slot = parse_slot(slot)
+        duration = parse_duration(request.values.get("duration", 10.0, type=float))
+        if duration.is_integer():
+            duration = int(duration)
+
+        upload = request.files.get("file")
+        raw = upload.read() if upload else request.get_data()
+        file_crc = request.values.get("crc", type=int)
+        if file_crc is not None and file_crc != zlib.crc32(raw) & 0xFFFFFFFF:
+            return jsonify({"message": "CRC mismatch", "expected_crc": zlib.crc32(raw) & 0xFFFFFFFF, "status": "error"}), 400
+
+        with UPLOAD_STAGE_SECONDS.time(stage="decode"):
+            frames, delays = ingest_cache.decode(raw, WIDTH, HEIGHT, MAX_ANIMATION_FRAMES)
+        return store_image(slot, duration, frames_crc(frames), frames, delays)
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 400
 
 
+def store_image(slot, duration, received_crc, frames, delays=None):
+    """
+    Validate packed frames against the client's CRC, save them to the slot
+    and interrupt the slot rotation to show it.
+    A single frame is a still image; more frames make an animated slot.
+    """
+    slot = parse_slot(slot)
+    duration = parse_duration(duration)
+    with UPLOAD_STAGE_SECONDS.time(stage="crc"):
+        calculated_crc = frames_crc(frames)
+    if calculated_crc != received_crc:
+        return jsonify({"message": "CRC mismatch", "expected_crc": calculated_crc, "status": "error"}), 400
+
+    slot_data = make_slot(duration, WIDTH, HEIGHT, frames, delays)
+    old_slot_data = slot_store.get(slot)
+    try:
+        with UPLOAD_STAGE_SECONDS.time(stage="persist"):
+            slot_store.save_slot(slot, slot_data)
+    except OSError as e:
+        return jsonify({"status": "error", "message": f"Failed to store slot {slot}: {e}"}), 500
+    release_frame(old_slot_data)
+    frame_cache.get_frames(slot_data)
+    render_queue.notify_slots_changed()
+    logger.info("Updated slot %s after setting image", slot)
+
+    render_queue.submit(slot_data, UPLOAD_DISPLAY_SECONDS, POLICY_PREEMPT)
+    logger.debug("Temporary image set for display")
+    return jsonify({"status": "success","crc": calculated_crc, "slot": slot}), 200
+
+
+@app.route("/image/batch", methods=["POST"])
+def set_images_batch():
+    """
+    Endpoint to upload several slots in one request.
+    Expects JSON {"slots": [<same objects as POST /image>, ...], "preempt": bool},
+    or an application/octet-stream body of back-to-back binary uploads (see
+    `set_image_binary`) with `preempt` in the query string.
+    Every CRC is checked before anything is stored; then all slots are
+    written together and the rotation is updated once. With preempt (the
+    default) the first slot is shown right away like a single upload; with
+    preempt false the batch only joins the rotation.
+    """
+    try:
+        if request.mimetype == "application/octet-stream":
+            preempt = request.args.get("preempt", "true").lower() not in ("0", "false", "no")
+            body = request.get_data()
+            record_size = IMAGE_UPLOAD_HEADER.size + WIDTH * HEIGHT * 4
+            if not body or len(body) % record_size:
+                return jsonify({"status": "error", "message": f"Invalid payload, expected a multiple of {record_size} bytes"}), 400
+            uploads = []
+            for offset in range(0, len(body), record_size):
+                slot, duration, received_crc = IMAGE_UPLOAD_HEADER.unpack_from(body, offset)
+                if duration.is_integer():
+                    duration = int(duration)
+                pixels = body[offset + IMAGE_UPLOAD_HEADER.size:offset + record_size]
+                uploads.append((slot, duration, received_crc, [pixels], None))
+        else:
+            with UPLOAD_STAGE_SECONDS.time(stage="parse"):
+                data = request.get_json()
+                if not data or not isinstance(data.get("slots"), list) or not data["slots"]:
+                    return jsonify({"status": "error", "message": "Invalid payload, slots not in data"}), 400
+                preempt = bool(data.get("preempt", True))
+                uploads = [parse_image_json(entry) for entry in data["slots"]]
+
+        updates = {}
+        errors = {}
+        for slot, duration, received_crc, frames, delays in uploads:
+            slot = parse_slot(slot)
+            duration = parse_duration(duration)
+            with UPLOAD_STAGE_SECONDS.time(stage="crc"):
+                calculated_crc = frames_crc(frames)
+            if calculated_crc != received_crc:
+                errors[str(slot)] = {"message": "CRC mismatch", "expected_crc": calculated_crc}
+                continue
+            updates[str(slot)] = make_slot(duration, WIDTH, HEIGHT, frames, delays)
+        if errors:
+            return jsonify({"status": "error", "message": "No slots were stored", "errors": errors}), 400
+
+        old_slots = slot_store.load()
+        try:
+            with UPLOAD_STAGE_SECONDS.time(stage="persist"):
+                slot_store.save_slots(updates)
+        except OSError as e:
+            return jsonify({"status": "error", "message": f"Failed to store slots: {e}"}), 500
+        for slot, slot_data in updates.items():
+            release_frame(old_slots.get(slot))
+            frame_cache.get_frames(slot_data)
+        render_queue.notify_slots_changed()
+        logger.info("Updated slots %s from batch upload", ", ".join(updates))
+
+        if preempt:
+            render_queue.submit(next(iter(updates.values())), UPLOAD_DISPLAY_SECONDS, POLICY_PREEMPT)
+        return jsonify({"status": "success", "slots": {slot: slot_data["crc"] for slot, slot_data in updates.items()}}), 200
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+
+@app.route("/image", methods=["PATCH"])
+def patch_image():
+    """
+    Endpoint to update a rectangle of a still slot in place.
+    Expects JSON payload with keys: slot, x, y, width, height, pixels (width*height
+    ARGB values, row by row) and crc (of the whole frame after the patch),
+    or an application/octet-stream body: an IMAGE_PATCH_HEADER followed by
+    the rectangle's big-endian ARGB words.
+    """
+    try:
+        if request.mimetype == "application/octet-stream":
+            body = request.get_data()
+            if len(body) < IMAGE_PATCH_HEADER.size:
+                return jsonify({"status": "error", "message": "Invalid payload"}), 400
+            slot, x, y, width, height, received_crc = IMAGE_PATCH_HEADER.unpack_from(body)
+            patch_data = body[IMAGE_PATCH_HEADER.size:]
+        else:
+            data = request.get_json()
+            if not data:
+                return jsonify({"status": "error", "message": "Invalid payload"}), 400
+            for key in ("slot", "x", "y", "width", "height", "pixels", "crc"):
+                if key not in data:
+                    return jsonify({"status": "error", "message": f"Invalid payload, {key} not in data"}), 400
+            slot, x, y, width, height, received_crc = (data[key] for key in ("slot", "x", "y", "width", "height", "crc"))
+            patch_data = pack_pixels(data["pixels"])
+
+        return apply_patch(slot, x, y, width, height, received_crc, patch_data)
+
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+
+def apply_patch(slot, x, y, width, height, received_crc, patch_data):
+    """
+    Paste a rectangle of packed pixels into a still slot. Only the changed
+    rows are written to the slot file, and only the rectangle is redrawn.
+    """
+    slot = parse_slot(slot)
+    old_slot_data = slot_store.get(slot)
+    if old_slot_data is None:
+        return jsonify({"status": "error", "message": f"Slot {slot} is empty or does not exist"}), 400
+    if "delays" in old_slot_data:
+        return jsonify({"status": "error", "message": f"Slot {slot} is animated and can't be patched"}), 400
+
+    frame_width, frame_height = old_slot_data["width"], old_slot_data["height"]
+    if width < 1 or height < 1 or x < 0 or y < 0 or x + width > frame_width or y + height > frame_height:
+        return jsonify({"status": "error", "message": "Invalid payload, rectangle is outside the frame"}), 400
+    if len(patch_data) != width * height * 4:
+        return jsonify({"status": "error", "message": f"Invalid payload, expected {width * height} pixels"}), 400
+
+    frame = bytearray(old_slot_data["data"])
+    row_size = width * 4
+    changes = []
+    for row in range(height):
+        offset = ((y + row) * frame_width + x) * 4
+        chunk = patch_data[row * row_size:(row + 1) * row_size]
+        frame[offset:offset + row_size] = chunk
+        changes.append((offset, chunk))
+
+    with UPLOAD_STAGE_SECONDS.time(stage="crc"):
+        calculated_crc = calculate_crc(frame)
+    if calculated_crc != received_crc:
+        return jsonify({"message": "CRC mismatch", "expected_crc": calculated_crc, "status": "error"}), 400
+
+    slot_data = dict(old_slot_data, crc=calculated_crc, data=bytes(frame))
+    try:
+        with UPLOAD_STAGE_SECONDS.time(stage="persist"):
+            slot_store.patch_slot(slot, slot_data, changes)
+    except OSError as e:
+        return jsonify({"status": "error", "message": f"Failed to store slot {slot}: {e}"}), 500
+
+    region = decode_frame(patch_data, (width, height))
+    if frame_cache.patch(old_slot_data["crc"], calculated_crc, region, (x, y)) is None:
+        frame_cache.get_frames(slot_data)
+    if renderer:
+        renderer.patch(old_slot_data["crc"], calculated_crc, region, x, y)
+    release_frame(old_slot_data)
+    render_queue.notify_slots_changed()
+    logger.info("Patched %sx%s at (%s, %s) in slot %s", width, height, x, y, slot)
+    return jsonify({"status": "success", "crc": calculated_crc, "slot": slot}), 200
+
+
 @app.route("/image", methods=["GET"])
 def get_image():
     """
     Endpoint to fetch image data for a specific slot.
+    The response carries a strong ETag derived from the slot's CRC, duration and frame delays
+    and honours If-None-Match. `?format=binary` returns IMAGE_UPLOAD_HEADER
+    followed by the packed ARGB pixels of every frame instead of JSON.
     """
-    slots = load_slots()
-
     slot = request.args.get("slot", type=str)
     if slot is None:
         return jsonify({"status":"error", "message":"Missing 'slot' parameter"}), 400
-    print(f"Slot in get_image: {slot}")
-    slot_data = slots.get(slot)
-    print(f"Slots in get_image: {slots}")
-    print(f"len(slots) in get_image:{len(slots)}")
+    binary = request.args.get("format") == "binary"
+    slot_data = slot_store.get(slot)
 
-    print(f"Requested slot_data in get_image: {slot_data}")
     if slot_data is None:
         return jsonify({"status":"error", "message":f"Slot {slot} is empty or does not exist"}), 400
-    
+    logger.debug("Requested slot %s in get_image: crc %08x", slot, slot_data["crc"])
+
+    etag = f"{slot_data['crc']:08x}-{slot_data['duration']:g}"
+    if slot_data.get("delays"):
+        etag = f"{etag}-{delays_crc(slot_data['delays']):08x}"
+    if binary:
+        return conditional_response(f"{etag}-bin", lambda: slot_to_binary(slot, slot_data), compress=True)
+    return conditional_response(etag, lambda: jsonify({"slot": slot, **slot_to_json(slot_data)}), compress=True)
+
+
+def conditional_response(etag, build, compress=False):
+    """
+    Serve the response returned by `build()` under a strong ETag.
+    A request whose If-None-Match matches gets a 304 without the body being
+    built. With `compress`, clients that accept gzip get a gzipped body under
+    its own ETag.
+    """
+    compress = compress and request.accept_encodings["gzip"] > 0
+    if compress:
+        etag = f"{etag}-gzip"
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = build()
+        if compress:
+            response.set_data(gzip.compress(response.get_data(), compresslevel=GZIP_LEVEL))
+            response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def slot_to_binary(slot, slot_data):
+    """
+    Binary GET /image body: the upload header, then every frame's pixels.
+    Frame count and delays of animated slots go in X-Frame-Count and X-Frame-Delays.
+    """
+    body = IMAGE_UPLOAD_HEADER.pack(int(slot), slot_data["duration"], slot_data["crc"])
+    body += b"".join(iter_frames(slot_data))
+    response = app.response_class(body, mimetype="application/octet-stream")
+    if "delays" in slot_data:
+        response.headers["X-Frame-Count"] = str(len(slot_data["delays"]))
+        response.headers["X-Frame-Delays"] = ",".join(f"{delay:g}" for delay in slot_data["delays"])
+    return response
+
+
+def slot_metadata(slot_data):
+    """
+    Pixel-free summary of a stored slot record.
+    """
+    if slot_data is None:
+        return None
+    return {
+        "duration": slot_data["duration"],
+        "crc": slot_data["crc"],
+        "width": slot_data["width"],
+        "height": slot_data["height"],
+        "frames": len(slot_data.get("delays") or [None]),
+        "delays_crc": delays_crc(slot_data.get("delays")),
+    }
+
+
+def slot_to_json(slot_data):
+    """
+    Convert a stored slot record into the JSON shape the app expects.
+    """
+    if slot_data is None:
+        return None
     response_data = {
-        "slot": slot,
         "duration": slot_data["duration"],
-        "pixels": slot_data["pixels"],
+        "pixels": unpack_pixels(slot_data["data"]),
         "crc": slot_data["crc"]
     }
-    print(f"response_data: {response_data}")
-    return jsonify(response_data), 200
+    if "delays" in slot_data:
+        response_data["frames"] = [{"pixels": unpack_pixels(frame), "delay": delay}
+                                   for frame, delay in zip(iter_frames(slot_data), slot_data["delays"])]
+    return response_data
+
 
 @app.route("/image/reset", methods=["POST"])
 def reset_slots():
     """Endpoint to reset all slots."""
-    global slots
-    slots = {i: None for i in range(6)}  
-    save_slots()
+    slot_store.reset()
+    frame_cache.clear()
+    render_queue.notify_slots_changed()
     return jsonify({"message": "All slots reset", "status": "success"}), 200
 
 
@@ -367,7 +684,7 @@ def set_pixels(duration, pixels):
                 r = pixels[index]
                 g = pixels[index + 1]
                 b = pixels[index + 2]
-                print(f'Setting Pixel x: {x}, y: {y}, red: {r}, green: {g}, blue: {b}')
+                logger.debug("Setting Pixel x: %s, y: %s, red: %s, green: %s, blue: %s", x, y, r, g, b)
                 index += 3
     time.sleep(duration)
 
@@ -375,98 +692,97 @@ def set_pixels(duration, pixels):
 @app.route('/display_image', methods=['POST'])
 def display_image_from_request():
     """
-    Receives an image dictionary and displays it on the LED matrix.
+    Receives an image dictionary and queues it for display on the LED matrix.
+    Returns immediately with a job ID; see GET /display_image/<job_id>.
     """
     data = request.get_json()
     if not data:
         return jsonify({"message": "No data received"}), 400
 
     try:
-        display_on_matrix(data)
-        return jsonify({"message": "Image displayed successfully"}), 200
+        job = display_on_matrix(data)
+        return jsonify({"message": "Image queued for display", "job_id": job.id, "status": job.status}), 200
     except ValueError as ve:
         return jsonify({"message": f"Invalid image data: {str(ve)}"}), 400
     except Exception as e:
         return jsonify({"message": f"Failed to display image: {str(e)}"}), 500
 
-def display_image(pixels):
-    if not matrix:
-        print("Matrix not initialized.")
-        return
-    img = Image.new("RGB", (64, 64))
-    img.putdata([tuple((p >> 16 & 255, p >> 8 & 255, p & 255)) for p in pixels])
-    matrix.SetImage(img)
+@app.route('/display_image/<job_id>', methods=['GET'])
+def get_display_job(job_id):
+    """
+    Endpoint to check the status of a /display_image job.
+    """
+    job = render_queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Unknown job {job_id}"}), 404
+    return jsonify(job.to_dict()), 200
 
 
-def display_on_matrix(image_data):
+def release_frame(old_slot_data):
     """
-    Displays an image on the LED matrix using the provided image data.
-    :param image_data: A dictionary containing 'pixels', 'duration', and 'crc'.
+    Drop the cached frame of a slot that was cleared or overwritten,
+    unless another slot still shows the same image.
     """
-    options = RGBMatrixOptions()
-    options.rows = 64
-    options.cols = 64
-    options.chain_length = 1
-    options.parallel = 1
-    options.hardware_mapping = 'regular'
-    options.disable_hardware_pulsing = True
+    if old_slot_data is None:
+        return
+    crc = old_slot_data["crc"]
+    if not any(slot_data and slot_data["crc"] == crc for slot_data in slot_store.load().values()):
+        frame_cache.evict(crc)
 
-    matrix = RGBMatrix(options=options)
 
+def display_on_matrix(image_data):
+    """
+    Queues an image for the render loop to display on the LED matrix.
+    :param image_data: A dictionary containing 'pixels', 'duration' and optionally 'policy'
+                       ('queue' to wait for the current job, 'preempt' to replace it).
+    :return: The submitted RenderJob.
+    """
     pixels = image_data.get('pixels', [])
-    if len(pixels) != 64 * 64:
+    if len(pixels) != WIDTH * HEIGHT:
         raise ValueError("Pixel data does not match the expected 64x64 size.")
 
-    image = Image.new('RGB', (64, 64))
-    image.putdata([tuple((p >> 16 & 255, p >> 8 & 255, p & 255)) for p in pixels])
+    pixel_data = pack_pixels(pixels)
+    slot_data = {"crc": calculate_crc(pixel_data), "width": WIDTH, "height": HEIGHT, "data": pixel_data}
+    duration = parse_duration(image_data.get('duration', 300))
+    return render_queue.submit(slot_data, duration, image_data.get('policy', POLICY_QUEUE))
 
-    matrix.SetImage(image)
+@app.route("/stream", methods=["GET"])
+def get_stream_stats():
+    """
+    Endpoint to read the live stream counters: frames received, displayed and dropped.
+    """
+    return jsonify(stream_receiver.stats()), 200
 
-    duration = image_data.get('duration', 300)
-    time.sleep(duration)
 
-    matrix.Clear()
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Endpoint for Prometheus: request and upload stage latencies, render and
+    scheduler timings, and cache and stream counters in the text format.
+    """
+    return app.response_class(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 
 @app.route("/ping", methods=["GET", "POST"])
 def ping():
     return jsonify({"status": "success", "message": "Received ping"}), 200
 
 
-def start_udp_listener():
-    """
-    Listens for UDP broadcast messages and responds with device info.
-    """
-    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    udp_socket.bind(("", 14440))
-
-    print("Listening for UDP broadcasts...")
-    while True:
-        data, addr = udp_socket.recvfrom(1024)
-        message = data.decode()
-        print(f"Received broadcast: {message} from {addr}")
-        if message.startswith("RaspiFrame:"):
-            response = f"RaspiFrame:{get_ip_address()}"
-            udp_socket.sendto(response.encode(), addr)
-            return
-
-
 def get_ip_address():
     """
-    Gets the IP address of the device from the `hostname` command.
+    Gets the IP address of the device, as cached by the discovery service.
     """
-    try:
-        ip_address = os.popen('hostname -I').read().strip().split()[0]
-        return ip_address
-    except Exception as e:
-        print(f"Error getting IP address: {e}")
-        return "127.0.0.1"
+    return discovery_service.ip_address
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("PICOFRAME_LOG_LEVEL", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     initialize_matrix()
-    initialize_slots()
-    start_udp_listener()
+    slot_store.initialize()
+    slot_store.start_compaction()
     listener_thread = threading.Thread(target=slot_display_loop, daemon=True)
     listener_thread.start()
+    stream_receiver.start()
+    discovery_service.start()
     app.run(host="0.0.0.0", port=14440)
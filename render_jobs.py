@@ -0,0 +1,155 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+POLICY_QUEUE = "queue"
+POLICY_PREEMPT = "preempt"
+POLICIES = (POLICY_QUEUE, POLICY_PREEMPT)
+
+
+class RenderJob:
+    """
+    A one-off image the render loop should show for `duration` seconds,
+    or, when `stream` is set, a live stream the loop plays until it goes idle.
+    """
+
+    def __init__(self, slot_data, duration, policy, stream=None):
+        self.id = uuid.uuid4().hex
+        self.slot_data = slot_data
+        self.stream = stream
+        self.duration = duration
+        self.policy = policy
+        self.status = "queued"
+        self.preempted = False
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "policy": self.policy,
+            "duration": self.duration,
+            "crc": self.slot_data["crc"] if self.slot_data else None,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class RenderQueue:
+    """
+    Hand-off between request handlers and the thread that owns the display.
+
+    Handlers `submit` jobs and return straight away; only the render loop
+    touches the panel. A job submitted with the 'preempt' policy cancels
+    everything still queued and cuts the job on screen short, while 'queue'
+    waits for its turn. The last `history` jobs are kept for status lookups.
+
+    The queue is also what the render loop sleeps on: `wait_for_interrupt`
+    blocks until a deadline, a job that should interrupt, or (optionally) a
+    change to the slots announced with `notify_slots_changed`.
+    """
+
+    def __init__(self, history=32):
+        self.history = history
+        self.slots_generation = 0
+        self._queue = deque()
+        self._jobs = OrderedDict()
+        self._active = None
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def submit(self, slot_data, duration, policy=POLICY_QUEUE, stream=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown display policy: {policy}")
+        job = RenderJob(slot_data, duration, policy, stream)
+        with self._lock:
+            if policy == POLICY_PREEMPT:
+                for queued in self._queue:
+                    queued.status = "cancelled"
+                    queued.finished = time.time()
+                self._queue.clear()
+                if self._active:
+                    self._active.preempted = True
+            self._queue.append(job)
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history:
+                oldest_id = next(iter(self._jobs))
+                if self._jobs[oldest_id].status in ("queued", "displaying"):
+                    break
+                del self._jobs[oldest_id]
+            self._changed.notify_all()
+        return job
+
+    def next_job(self):
+        """Take the next queued job and mark it as displaying, or return None."""
+        with self._lock:
+            if not self._queue:
+                return None
+            job = self._queue.popleft()
+            job.status = "displaying"
+            job.started = time.time()
+            self._active = job
+            return job
+
+    def finish(self, job, failed=False):
+        with self._lock:
+            job.status = "failed" if failed else "preempted" if job.preempted else "done"
+            job.finished = time.time()
+            if self._active is job:
+                self._active = None
+
+    def should_interrupt(self):
+        """
+        True when the render loop should stop what it is showing: a job is
+        waiting and nothing else is on screen, or the active job was preempted.
+        """
+        with self._lock:
+            return self._should_interrupt()
+
+    def _should_interrupt(self):
+        if self._active is not None:
+            return self._active.preempted
+        return bool(self._queue)
+
+    def notify_slots_changed(self):
+        """Tell the render loop that slot contents changed."""
+        with self._lock:
+            self.slots_generation += 1
+            self._changed.notify_all()
+
+    def wake(self):
+        """Wake the render loop so it re-checks whatever it is waiting for."""
+        with self._lock:
+            self._changed.notify_all()
+
+    def wait(self, predicate, timeout):
+        """Block until `predicate()` is true or `timeout` runs out; returns the predicate's value."""
+        with self._lock:
+            return self._changed.wait_for(predicate, timeout)
+
+    def wait_for_interrupt(self, timeout, slots_generation=None):
+        """
+        Block for up to `timeout` seconds (None waits forever) until the render
+        loop should be interrupted, or the slots change if `slots_generation`
+        is given and no longer current.
+
+        Returns:
+            bool: True if woken early, False if the timeout ran out.
+        """
+        def woken():
+            if slots_generation is not None and slots_generation != self.slots_generation:
+                return True
+            return self._should_interrupt()
+
+        if timeout is not None and timeout < 0:
+            timeout = 0
+        with self._lock:
+            return self._changed.wait_for(woken, timeout)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
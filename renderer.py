@@ -0,0 +1,102 @@
+import threading
+
+from metrics import REGISTRY
+
+RENDER_SECONDS = REGISTRY.histogram(
+    "picoframe_render_seconds",
+    "Time spent drawing a frame into the back buffer (draw) and swapping it onto the panel (swap).",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+    labelnames=("stage",))
+
+
+class FrameRenderer:
+    """
+    Double-buffered renderer on top of a display backend.
+
+    Frames are drawn into an offscreen canvas with `prepare` and made visible
+    with `present`, which swaps the canvases on vsync. The panel never shows a
+    half-drawn frame, and the slot loop can draw the next slot while the current
+    one is still on screen, so a slot change is just a buffer swap.
+    """
+
+    def __init__(self, display, frame_cache):
+        self.display = display
+        self.frame_cache = frame_cache
+        self._back = display.create_canvas()
+        self._front = None
+        # (crc, frame index) held by each canvas; None means blank.
+        self._back_key = None
+        self._front_key = None
+        self._lock = threading.Lock()
+
+    def prepare(self, slot_data, frame=0):
+        """
+        Draw a frame of a slot into the back buffer, unless it already holds it.
+        Passing None blanks the back buffer.
+        """
+        with self._lock:
+            self._prepare(slot_data, frame)
+
+    def _prepare(self, slot_data, frame=0):
+        key = (slot_data["crc"], frame) if slot_data else None
+        if key is not None and key == self._back_key:
+            return
+        if key is None:
+            self.display.blank(self._back)
+        else:
+            with RENDER_SECONDS.time(stage="draw"):
+                self.display.draw(self._back, self.frame_cache.get(slot_data, frame))
+        self._back_key = key
+
+    def present(self):
+        """Swap the back buffer onto the panel at the next vsync."""
+        with self._lock:
+            self._present()
+
+    def _present(self):
+        self._front = self._back
+        with RENDER_SECONDS.time(stage="swap"):
+            self._back = self.display.swap(self._back)
+        self._back_key, self._front_key = self._front_key, self._back_key
+
+    def show(self, slot_data, frame=0):
+        """Put a frame of a slot on the panel, drawing it first if it isn't already prepared."""
+        with self._lock:
+            if slot_data and (slot_data["crc"], frame) == self._front_key:
+                return
+            self._prepare(slot_data, frame)
+            self._present()
+
+    def patch(self, old_crc, new_crc, region, x, y):
+        """
+        Apply a patched rectangle of a still slot. Canvases holding the old
+        frame get only `region` redrawn at (x, y) and are re-labelled with the
+        new CRC; the visible canvas is updated in place, without a swap.
+        """
+        with self._lock:
+            old_key, new_key = (old_crc, 0), (new_crc, 0)
+            if self._front is not None and self._front_key == old_key:
+                self.display.draw_region(self._front, region, x, y)
+                self._front_key = new_key
+            if self._back_key == old_key:
+                self.display.draw_region(self._back, region, x, y)
+                self._back_key = new_key
+
+    def show_image(self, image, key):
+        """
+        Draw an image that isn't a slot, such as a live stream frame, and swap
+        it onto the panel. `key` identifies the image in place of a slot CRC.
+        """
+        with self._lock:
+            with RENDER_SECONDS.time(stage="draw"):
+                self.display.draw(self._back, image)
+            self._back_key = key
+            self._present()
+
+    def clear(self):
+        """Blank the panel."""
+        with self._lock:
+            if self._front_key is None:
+                return
+            self._prepare(None)
+            self._present()
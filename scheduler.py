@@ -0,0 +1,182 @@
+import logging
+import time
+
+from metrics import REGISTRY
+
+DEFAULT_SLOT_DURATION = 10
+DEFAULT_FRAME_DELAY = 0.1
+# Shortest per-frame delay honoured for animated slots (caps playback at 100 fps).
+MIN_FRAME_DELAY = 0.01
+# Longest slot duration accepted; also keeps every wait below threading.TIMEOUT_MAX.
+MAX_SLOT_DURATION = 24 * 60 * 60
+# How long an empty rotation waits before rescanning the slot files anyway,
+# in case they were changed on disk by another process.
+IDLE_RESCAN_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+SLOT_LATENESS_SECONDS = REGISTRY.histogram(
+    "picoframe_slot_lateness_seconds",
+    "How long after its deadline each slot went on the panel.",
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+    labelnames=("slot",))
+
+
+def bounded(value, minimum, maximum, default):
+    """
+    Clamp a stored duration or delay to [minimum, maximum]. NaN, which
+    max() and min() pass through, and non-numbers give `default`.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value:
+        return default
+    return min(max(value, minimum), maximum)
+
+
+class SlotScheduler:
+    """
+    Deadline-based slot rotation.
+
+    Each slot is shown at a deadline on the monotonic clock and the next
+    deadline is the previous one plus the slot's duration, so timing errors do
+    not accumulate across the rotation. Between deadlines the loop blocks on
+    the render queue's condition instead of polling, and wakes immediately
+    when a render job needs the panel. Animated slots are stepped through
+    with the same deadline arithmetic, one deadline per frame.
+    """
+
+    def __init__(self, slot_store, render_queue, renderer, clock=time.monotonic):
+        self.slot_store = slot_store
+        self.render_queue = render_queue
+        self.renderer = renderer
+        self.clock = clock
+        self.last_slot = None
+        self.last_lateness = 0.0
+
+    def wait_until(self, deadline, slots_generation=None):
+        """Sleep until `deadline`; returns True if a render job interrupted the wait."""
+        timeout = None if deadline is None else deadline - self.clock()
+        return self.render_queue.wait_for_interrupt(timeout, slots_generation)
+
+    def play(self, slot_data, until, upcoming=None):
+        """
+        Keep a slot on the panel until `until`, stepping through its frames if
+        it is animated. The frame after the current one, or `upcoming` once the
+        slot is about to end, is drawn into the back buffer ahead of its swap.
+
+        Returns:
+            bool: True if a render job interrupted playback.
+        """
+        delays = slot_data.get("delays")
+        if not delays:
+            self.renderer.show(slot_data)
+            self.renderer.prepare(upcoming)
+            return self.wait_until(until)
+
+        frame = 0
+        frame_deadline = self.clock()
+        while True:
+            self.renderer.show(slot_data, frame)
+            frame_deadline += bounded(delays[frame], MIN_FRAME_DELAY, MAX_SLOT_DURATION, DEFAULT_FRAME_DELAY)
+            next_frame = (frame + 1) % len(delays)
+            if frame_deadline < until:
+                self.renderer.prepare(slot_data, next_frame)
+            else:
+                self.renderer.prepare(upcoming)
+            if self.wait_until(min(frame_deadline, until)):
+                return True
+            if frame_deadline >= until:
+                return False
+            frame = next_frame
+
+    def play_stream(self, job):
+        """
+        Show live stream frames as they arrive until the job is preempted or
+        no frame has come in for `job.duration` seconds.
+        """
+        stream = job.stream
+        while self.render_queue.wait(lambda: job.preempted or stream.has_frame(), job.duration):
+            if job.preempted:
+                return
+            frame = stream.take_frame()
+            if frame is not None:
+                sequence, image = frame
+                self.renderer.show_image(image, ("stream", sequence))
+
+    def run_job(self, job):
+        failed = False
+        try:
+            if job.stream:
+                logger.info("Playing live stream for render job %s.", job.id)
+                self.play_stream(job)
+            else:
+                logger.info("Displaying render job %s for %s seconds.", job.id, job.duration)
+                self.play(job.slot_data, self.clock() + job.duration)
+        except Exception:
+            # A bad job must not end the only thread that draws on the panel.
+            logger.exception("Render job %s failed", job.id)
+            failed = True
+        self.render_queue.finish(job, failed)
+        logger.info("Render job %s %s", job.id, job.status)
+
+    def next_slot(self, slots, after):
+        """
+        Return (slot, slot_data) for the first slot with pixel data after `after`
+        in rotation order, or (None, None) if every slot is empty.
+        """
+        keys = list(slots)
+        start = keys.index(after) + 1 if after in keys else 0
+        for offset in range(len(keys)):
+            slot = keys[(start + offset) % len(keys)]
+            slot_data = slots[slot]
+            if slot_data and slot_data.get("data"):
+                return slot, slot_data
+        return None, None
+
+    def run(self):
+        deadline = None
+        while True:
+            job = self.render_queue.next_job()
+            if job:
+                self.run_job(job)
+                deadline = None
+                continue
+
+            slots_generation = self.render_queue.slots_generation
+            slots = self.slot_store.load()
+            slot, slot_data = self.next_slot(slots, self.last_slot)
+            if slot is None:
+                logger.info("No slots with images. Waiting...")
+                self.renderer.clear()
+                self.wait_until(self.clock() + IDLE_RESCAN_SECONDS, slots_generation)
+                deadline = None
+                continue
+
+            now = self.clock()
+            duration = bounded(slot_data.get("duration", DEFAULT_SLOT_DURATION),
+                               MIN_FRAME_DELAY, MAX_SLOT_DURATION, DEFAULT_SLOT_DURATION)
+            if deadline is None or now - deadline > duration:
+                # First slot, or we fell too far behind to catch up: restart the timeline.
+                deadline = now
+            elif deadline > now:
+                if self.wait_until(deadline):
+                    continue
+
+            logger.debug("Displaying image from slot %s for %s seconds.", slot, duration)
+            self.last_lateness = self.clock() - deadline
+            SLOT_LATENESS_SECONDS.observe(self.last_lateness, slot=slot)
+            deadline += duration
+
+            # The upcoming slot is drawn offscreen while this one is on the panel.
+            _, upcoming = self.next_slot(slots, slot)
+            try:
+                interrupted = self.play(slot_data, deadline, upcoming)
+            except Exception:
+                # Skip a slot that can't be shown rather than end the render thread;
+                # its time in the rotation passes as if it had played.
+                logger.exception("Failed to display slot %s", slot)
+                interrupted = False
+            if interrupted:
+                logger.info("Interrupt signal received, pausing slot rotation")
+                deadline = None
+                continue
+            self.last_slot = slot
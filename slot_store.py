@@ -0,0 +1,608 @@
+import json
+import logging
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+
+SLOTS_FILE = "slots_data.json"
+SLOTS_DIR = "slots"
+NUMBER_OF_SLOTS = 6
+
+# On-disk slot layout: a fixed header followed by the pixels as packed
+# big-endian ARGB words, i.e. exactly the bytes the CRC is computed over.
+# Version 2 adds a frame count; animated slots (count > 0) follow the first
+# frame with a table of (delay, delta length) entries and the frame deltas.
+SLOT_MAGIC = b"PFSL"
+SLOT_VERSION = 2
+PIXEL_FORMAT_ARGB8888 = 1
+SLOT_HEADER_V1 = struct.Struct("!4sBBHHfI")  # magic, version, format, width, height, duration, crc
+SLOT_HEADER = struct.Struct("!4sBBHHfIH")  # v1 header + frame count
+FRAME_ENTRY = struct.Struct("!fI")  # delay, delta length
+SLOT_CRC = struct.Struct("!I")
+
+# Slot changes are appended to a journal before they are acknowledged and
+# folded into the slot files (the snapshot) by a periodic compaction. A
+# record is JOURNAL_RECORD (magic, payload length, crc32 of the payload)
+# followed by its entries, each JOURNAL_ENTRY (op, slot key length, body
+# length), the slot key and the body. A record is applied whole or, if torn
+# or corrupt, not at all, so a batch of slots is all-or-nothing.
+JOURNAL_FILE = "journal.bin"
+JOURNAL_MAGIC = b"PFJR"
+JOURNAL_RECORD = struct.Struct("!4sII")
+JOURNAL_ENTRY = struct.Struct("!BBI")
+JOURNAL_PATCH_CHUNK = struct.Struct("!II")  # offset, length
+OP_SET = 1  # body: encode_slot() bytes, or empty to clear the slot
+OP_PATCH = 2  # body: new crc, then (offset, length, bytes) chunks of pixel data
+COMPACT_SECONDS = 60
+COMPACT_JOURNAL_BYTES = 1 << 20
+
+logger = logging.getLogger(__name__)
+
+
+def pack_pixels(pixels):
+    """
+    Pack a list of ARGB integers into big-endian signed 32-bit words.
+
+    Args:
+        pixels (list of int): Signed ARGB values, as Java's int sends them.
+
+    Returns:
+        bytes: 4 bytes per pixel, the same layout Java's DataOutputStream produces.
+
+    Raises:
+        OverflowError: If a value does not fit in a signed 32-bit int.
+    """
+    words = array('i', pixels)
+    if sys.byteorder == 'little':
+        words.byteswap()
+    return words.tobytes()
+
+
+def unpack_pixels(data):
+    """
+    Unpack big-endian ARGB words back into the signed integers the app expects.
+    """
+    words = array('i')
+    words.frombytes(data)
+    if sys.byteorder == 'little':
+        words.byteswap()
+    return words.tolist()
+
+
+def xor_bytes(a, b):
+    """XOR two equally sized byte strings, using big-int arithmetic instead of a Python loop."""
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+
+
+def encode_deltas(frames):
+    """
+    Encode frames 1..n-1 as zlib-compressed XOR deltas against the previous frame.
+    Pixels that don't change between frames XOR to zero and compress away.
+    """
+    return [zlib.compress(xor_bytes(current, previous)) for previous, current in zip(frames, frames[1:])]
+
+
+def iter_frames(slot_data):
+    """Yield the packed pixels of every frame in a slot record, rebuilding deltas as it goes."""
+    frame = slot_data["data"]
+    yield frame
+    for delta in slot_data.get("deltas", ()):
+        frame = xor_bytes(frame, zlib.decompress(delta))
+        yield frame
+
+
+def frames_crc(frames):
+    """CRC32 over the packed pixels of all frames, in order."""
+    crc = 0
+    for frame in frames:
+        crc = zlib.crc32(frame, crc)
+    return crc & 0xFFFFFFFF
+
+
+def delays_crc(delays):
+    """
+    CRC32 over the frame delays as stored in the slot file (big-endian floats),
+    0 for a still slot. The pixel CRC doesn't cover the delays, so this is
+    what tells a re-timed animation apart.
+    """
+    if not delays:
+        return 0
+    return zlib.crc32(struct.pack(f"!{len(delays)}f", *delays)) & 0xFFFFFFFF
+
+
+def make_slot(duration, width, height, frames, delays=None):
+    """
+    Build a slot record from packed frames.
+
+    Args:
+        duration (float): Seconds the slot stays on the panel in the rotation.
+        width, height (int): Frame dimensions.
+        frames (list of bytes): Packed ARGB pixels, one entry per frame.
+        delays (list of float or None): Per-frame delay in seconds, for animated slots.
+    """
+    slot_data = {"duration": duration, "crc": frames_crc(frames), "width": width, "height": height,
+                 "data": frames[0]}
+    if len(frames) > 1:
+        slot_data["delays"] = list(delays)
+        slot_data["deltas"] = encode_deltas(frames)
+    return slot_data
+
+
+def encode_slot(slot_data):
+    """Serialize a slot record into the binary slot file format."""
+    delays = slot_data.get("delays", [])
+    header = SLOT_HEADER.pack(SLOT_MAGIC, SLOT_VERSION, PIXEL_FORMAT_ARGB8888,
+                              slot_data["width"], slot_data["height"],
+                              slot_data["duration"], slot_data["crc"], len(delays))
+    if not delays:
+        return header + slot_data["data"]
+    deltas = [b""] + slot_data["deltas"]
+    table = b"".join(FRAME_ENTRY.pack(delay, len(delta)) for delay, delta in zip(delays, deltas))
+    return b"".join([header, slot_data["data"], table] + deltas)
+
+
+def decode_slot(raw):
+    """
+    Parse a binary slot file.
+
+    Raises:
+        ValueError: If the header is unknown or the pixel data is truncated or corrupt.
+    """
+    if len(raw) < SLOT_HEADER_V1.size:
+        raise ValueError("Slot file is truncated")
+    magic, version, pixel_format, width, height, duration, crc = SLOT_HEADER_V1.unpack_from(raw)
+    if magic != SLOT_MAGIC or version not in (1, 2) or pixel_format != PIXEL_FORMAT_ARGB8888:
+        raise ValueError("Unknown slot file format")
+    frame_count, offset = 0, SLOT_HEADER_V1.size
+    if version == 2:
+        if len(raw) < SLOT_HEADER.size:
+            raise ValueError("Slot file is truncated")
+        frame_count = SLOT_HEADER.unpack_from(raw)[-1]
+        offset = SLOT_HEADER.size
+
+    frame_size = width * height * 4
+    data = raw[offset:offset + frame_size]
+    if len(data) != frame_size or (frame_count == 0 and len(raw) != offset + frame_size):
+        raise ValueError("Slot pixel data has the wrong size")
+    if duration.is_integer():
+        duration = int(duration)
+    slot_data = {"duration": duration, "crc": crc, "width": width, "height": height, "data": data}
+
+    if frame_count:
+        offset += frame_size
+        entries = [FRAME_ENTRY.unpack_from(raw, offset + i * FRAME_ENTRY.size) for i in range(frame_count)]
+        offset += frame_count * FRAME_ENTRY.size
+        deltas = []
+        for _, length in entries[1:]:
+            deltas.append(raw[offset:offset + length])
+            offset += length
+        if offset != len(raw):
+            raise ValueError("Slot frame data has the wrong size")
+        slot_data["delays"] = [round(delay, 6) for delay, _ in entries]
+        slot_data["deltas"] = deltas
+
+    try:
+        if frames_crc(iter_frames(slot_data)) != crc:
+            raise ValueError("Slot CRC mismatch")
+    except zlib.error:
+        raise ValueError("Slot frame delta is corrupt")
+    return slot_data
+
+
+class SlotStore:
+    """
+    Process-wide, in-memory copy of the slots.
+
+    Each slot is stored in its own binary file under `slots_dir`. Changes
+    are first appended, checksummed and fsynced, to a journal there, so a
+    write costs only the changed slot and a power cut can at worst lose a
+    torn last record. `initialize` replays the journal over the slot files
+    and `compact` (run periodically by `start_compaction`) writes the
+    changed slots out atomically and empties the journal. Reads are served
+    from memory; a slot file is re-read only when its mtime changes. `generation` is bumped on
+    every change so callers can cheaply tell whether anything moved, and each
+    slot remembers the generation it last changed at. Generations restart
+    with the process.
+
+    Slot records are dicts with `duration`, `crc`, `width`, `height` and
+    `data` (packed big-endian ARGB bytes). Animated slots also carry `delays`
+    (seconds per frame) and `deltas` (see `encode_deltas`), with `data` as the
+    first frame and `crc` covering all frames. Empty slots are None.
+    """
+
+    def __init__(self, slots_dir=SLOTS_DIR, number_of_slots=NUMBER_OF_SLOTS, legacy_file=SLOTS_FILE):
+        self.slots_dir = slots_dir
+        self.number_of_slots = number_of_slots
+        self.legacy_file = legacy_file
+        self.generation = 0
+        self._slots = dict.fromkeys(self._default_slots())
+        self._slot_generations = {}
+        self._mtimes = {}
+        self._dirty = set()
+        self._journal = None
+        self._compact_requested = threading.Event()
+        self._lock = threading.RLock()
+
+    def _default_slots(self):
+        return [str(i) for i in range(self.number_of_slots)]
+
+    def _touch(self, slot):
+        self.generation += 1
+        self._slot_generations[slot] = self.generation
+
+    def _slot_path(self, slot):
+        return os.path.join(self.slots_dir, f"slot_{slot}.bin")
+
+    def _scan(self):
+        """Return {slot: mtime_ns} for every slot file currently on disk."""
+        found = {}
+        try:
+            with os.scandir(self.slots_dir) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if name.startswith("slot_") and name.endswith(".bin"):
+                        found[name[5:-4]] = entry.stat().st_mtime_ns
+        except FileNotFoundError:
+            pass
+        return found
+
+    def _refresh(self):
+        """Reload any slot files that changed on disk since the last read."""
+        found = self._scan()
+        if found == self._mtimes:
+            return
+        for slot in set(self._mtimes) - set(found):
+            if slot in self._default_slots():
+                self._slots[slot] = None
+            else:
+                self._slots.pop(slot, None)
+            self._touch(slot)
+        for slot, mtime in found.items():
+            if self._mtimes.get(slot) == mtime:
+                continue
+            try:
+                with open(self._slot_path(slot), 'rb') as f:
+                    self._slots[slot] = decode_slot(f.read())
+            except (OSError, ValueError) as e:
+                logger.warning("Slot %s file is invalid: %s", slot, e)
+                self._slots[slot] = None
+            self._touch(slot)
+        self._mtimes = found
+
+    def _stage(self, slot, slot_data):
+        """Write a slot record to a temporary file beside its slot file; returns its path, or None for a clear."""
+        if slot_data is None:
+            return None
+        tmp_path = self._slot_path(slot) + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(encode_slot(slot_data))
+            f.flush()
+            os.fsync(f.fileno())
+        return tmp_path
+
+    def _commit(self, slot, tmp_path):
+        """Move a staged slot file into place, or remove the slot file if `tmp_path` is None."""
+        path = self._slot_path(slot)
+        if tmp_path is None:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._mtimes.pop(slot, None)
+        else:
+            os.replace(tmp_path, path)
+            self._mtimes[slot] = os.stat(path).st_mtime_ns
+
+    def _write(self, slot, slot_data):
+        self._commit(slot, self._stage(slot, slot_data))
+        self._touch(slot)
+
+    def _sync_dir(self):
+        """Make renames and removals in the slots directory durable."""
+        try:
+            fd = os.open(self.slots_dir, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _journal_path(self):
+        return os.path.join(self.slots_dir, JOURNAL_FILE)
+
+    def _append(self, entries):
+        """
+        Durably append one journal record holding `entries`, a list of
+        (op, slot, body). A failed append is cut off again so later records
+        stay readable.
+        """
+        payload = bytearray()
+        for op, slot, body in entries:
+            key = slot.encode()
+            payload += JOURNAL_ENTRY.pack(op, len(key), len(body)) + key + body
+        record = JOURNAL_RECORD.pack(JOURNAL_MAGIC, len(payload), zlib.crc32(payload) & 0xFFFFFFFF) + payload
+
+        if self._journal is None:
+            os.makedirs(self.slots_dir, exist_ok=True)
+            # Unbuffered, so a failed append leaves nothing behind to be flushed later.
+            self._journal = open(self._journal_path(), 'ab', buffering=0)
+        offset = self._journal.tell()
+        try:
+            view = memoryview(record)
+            while view:
+                view = view[self._journal.write(view):]
+            os.fsync(self._journal.fileno())
+        except OSError:
+            try:
+                os.ftruncate(self._journal.fileno(), offset)
+            except OSError:
+                # Can't roll back; reopen on the next append. A torn tail is cut off on replay.
+                self._journal.close()
+                self._journal = None
+            raise
+        for _, slot, _ in entries:
+            self._dirty.add(slot)
+        if offset + len(record) >= COMPACT_JOURNAL_BYTES:
+            self._compact_requested.set()
+
+    def _apply(self, op, slot, body):
+        """Apply one journal entry to the in-memory slots."""
+        if slot not in self._default_slots():
+            raise ValueError(f"Invalid slot {slot!r}")
+        if op == OP_SET:
+            self._slots[slot] = decode_slot(body) if body else None
+        elif op == OP_PATCH:
+            slot_data = self._slots.get(slot)
+            if slot_data is None or "delays" in slot_data:
+                raise ValueError(f"Can't patch slot {slot}")
+            crc = SLOT_CRC.unpack_from(body)[0]
+            data = bytearray(slot_data["data"])
+            offset = SLOT_CRC.size
+            while offset < len(body):
+                chunk_offset, length = JOURNAL_PATCH_CHUNK.unpack_from(body, offset)
+                offset += JOURNAL_PATCH_CHUNK.size
+                data[chunk_offset:chunk_offset + length] = body[offset:offset + length]
+                offset += length
+            self._slots[slot] = dict(slot_data, crc=crc, data=bytes(data))
+        else:
+            raise ValueError(f"Unknown journal op {op}")
+        self._dirty.add(slot)
+        self._touch(slot)
+
+    def _replay(self):
+        """
+        Apply the journal on top of the slot files. Anything after the first
+        torn or corrupt record is discarded.
+
+        Returns:
+            int: The number of records replayed.
+        """
+        try:
+            with open(self._journal_path(), 'rb') as f:
+                journal = f.read()
+        except FileNotFoundError:
+            return 0
+
+        offset = 0
+        records = 0
+        while offset < len(journal):
+            end = offset + JOURNAL_RECORD.size
+            if end > len(journal):
+                break
+            magic, length, crc = JOURNAL_RECORD.unpack_from(journal, offset)
+            payload = journal[end:end + length]
+            if magic != JOURNAL_MAGIC or len(payload) != length or zlib.crc32(payload) & 0xFFFFFFFF != crc:
+                break
+            position = 0
+            try:
+                while position < length:
+                    op, key_length, body_length = JOURNAL_ENTRY.unpack_from(payload, position)
+                    position += JOURNAL_ENTRY.size
+                    slot = payload[position:position + key_length].decode()
+                    position += key_length
+                    self._apply(op, slot, payload[position:position + body_length])
+                    position += body_length
+            except (ValueError, struct.error) as e:
+                logger.warning("Skipping journal record at offset %s: %s", offset, e)
+            offset = end + length
+            records += 1
+
+        if offset < len(journal):
+            logger.warning("Discarding %s bytes of torn journal at offset %s.", len(journal) - offset, offset)
+            with open(self._journal_path(), 'r+b') as f:
+                f.truncate(offset)
+        return records
+
+    def compact(self):
+        """
+        Write every slot changed since the last compaction to its slot file
+        (atomically, via a temporary file) and empty the journal. A crash
+        before the journal is emptied just replays records that are already
+        in the snapshot, which is harmless.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            for slot in sorted(self._dirty):
+                self._commit(slot, self._stage(slot, self._slots.get(slot)))
+            self._sync_dir()
+            if self._journal is not None:
+                self._journal.truncate(0)
+                self._journal.seek(0)
+                os.fsync(self._journal.fileno())
+            else:
+                with open(self._journal_path(), 'wb') as f:
+                    os.fsync(f.fileno())
+            logger.info("Compacted slots %s into the snapshot.", ", ".join(sorted(self._dirty)))
+            self._dirty.clear()
+
+    def start_compaction(self, interval=COMPACT_SECONDS):
+        """Compact on a background thread every `interval` seconds, or sooner if the journal grows large."""
+        def compaction_loop():
+            while True:
+                self._compact_requested.wait(interval)
+                self._compact_requested.clear()
+                try:
+                    self.compact()
+                except OSError as e:
+                    logger.error("Slot compaction failed: %s", e)
+
+        threading.Thread(target=compaction_loop, daemon=True).start()
+
+    def _migrate_legacy_file(self):
+        """
+        One-time migration of the old slots_data.json into per-slot binary files.
+        The JSON file is kept, renamed with a `.migrated` suffix.
+        """
+        try:
+            with open(self.legacy_file, 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except json.JSONDecodeError:
+            logger.warning("Legacy slots file is invalid, skipping migration.")
+            return
+
+        for slot, slot_data in data.get("slots", {}).items():
+            if not slot_data or not slot_data.get("pixels"):
+                continue
+            pixels = slot_data["pixels"]
+            side = int(len(pixels) ** 0.5)
+            if side * side != len(pixels):
+                logger.warning("Slot %s in %s is not square, skipping.", slot, self.legacy_file)
+                continue
+            data = pack_pixels(pixels)
+            record = {"duration": slot_data.get("duration", 10), "crc": zlib.crc32(data) & 0xFFFFFFFF,
+                      "width": side, "height": side, "data": data}
+            self._slots[slot] = record
+            self._write(slot, record)
+            logger.info("Migrated slot %s from %s.", slot, self.legacy_file)
+        os.replace(self.legacy_file, self.legacy_file + ".migrated")
+
+    def initialize(self):
+        """
+        Create the slots directory, migrate the legacy JSON file if present,
+        load all slots and replay the journal over them.
+        """
+        with self._lock:
+            os.makedirs(self.slots_dir, exist_ok=True)
+            self._migrate_legacy_file()
+            self._refresh()
+            records = self._replay()
+            if records:
+                logger.info("Replayed %s journal records.", records)
+                try:
+                    self.compact()
+                except OSError as e:
+                    # The journal still holds the changes; the background compaction retries.
+                    logger.error("Slot compaction failed: %s", e)
+            logger.info("Slots have been initialized.")
+
+    def load(self):
+        """
+        Return a shallow copy of all slots, keyed by slot number as a string.
+        """
+        with self._lock:
+            self._refresh()
+            return dict(self._slots)
+
+    def get(self, slot_number):
+        """Return the data stored in a single slot, or None if it is empty."""
+        with self._lock:
+            self._refresh()
+            return self._slots.get(str(slot_number))
+
+    def manifest(self):
+        """
+        Return {"generation": n, "slots": {slot: {"crc", "delays_crc", "duration", "generation"} or None}},
+        enough for a client to tell which slots it needs to upload.
+        """
+        with self._lock:
+            self._refresh()
+            slots = {}
+            for slot, slot_data in self._slots.items():
+                if slot_data is not None:
+                    slot_data = {"crc": slot_data["crc"], "delays_crc": delays_crc(slot_data.get("delays")),
+                                 "duration": slot_data["duration"],
+                                 "generation": self._slot_generations.get(slot, 0)}
+                slots[slot] = slot_data
+            return {"generation": self.generation, "slots": slots}
+
+    def save_slot(self, slot_number, slot_data):
+        """
+        Update a specific slot in memory and record it in the journal.
+
+        Args:
+            slot_number (int or str): The slot number to update.
+            slot_data (dict or None): The slot record to store, or None to clear the slot.
+
+        Raises:
+            OSError: If the journal couldn't be written; the slot is unchanged then.
+        """
+        slot = str(slot_number)
+        with self._lock:
+            self._refresh()
+            self._append([(OP_SET, slot, encode_slot(slot_data) if slot_data else b"")])
+            self._slots[slot] = slot_data
+            self._touch(slot)
+            logger.info("Slot %s successfully saved.", slot)
+
+    def save_slots(self, updates):
+        """
+        Store several slots at once, as a single journal record, so after a
+        crash either the whole batch is there or none of it is.
+
+        Args:
+            updates (dict): {slot number: slot record or None}.
+
+        Raises:
+            OSError: If the journal couldn't be written; nothing is changed then.
+        """
+        updates = {str(slot): slot_data for slot, slot_data in updates.items()}
+        with self._lock:
+            self._refresh()
+            self._append([(OP_SET, slot, encode_slot(slot_data) if slot_data else b"")
+                          for slot, slot_data in updates.items()])
+            for slot, slot_data in updates.items():
+                self._slots[slot] = slot_data
+                self._touch(slot)
+            logger.info("Slots %s successfully saved.", ", ".join(updates))
+
+    def patch_slot(self, slot_number, slot_data, changes):
+        """
+        Replace a still slot with a patched copy. Only the changed bytes and
+        the new CRC go into the journal; the slot file catches up on the next
+        compaction.
+
+        Args:
+            slot_number (int or str): The slot number to update.
+            slot_data (dict): The patched slot record.
+            changes (list of (int, bytes)): Byte offsets into the pixel data and the bytes written there.
+
+        Raises:
+            OSError: If the journal couldn't be written; the slot is unchanged then.
+        """
+        slot = str(slot_number)
+        body = bytearray(SLOT_CRC.pack(slot_data["crc"]))
+        for offset, chunk in changes:
+            body += JOURNAL_PATCH_CHUNK.pack(offset, len(chunk)) + chunk
+        with self._lock:
+            self._refresh()
+            self._append([(OP_PATCH, slot, bytes(body))])
+            self._slots[slot] = slot_data
+            self._touch(slot)
+            logger.info("Slot %s successfully patched.", slot)
+
+    def reset(self):
+        """Set every slot back to None."""
+        with self._lock:
+            self._append([(OP_SET, slot, b"") for slot in self._slots])
+            for slot in list(self._slots):
+                self._touch(slot)
+            self._slots = dict.fromkeys(self._default_slots())
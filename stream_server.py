@@ -0,0 +1,176 @@
+import logging
+import socket
+import struct
+import threading
+
+from frame_cache import decode_frame
+from render_jobs import POLICY_PREEMPT
+
+STREAM_PORT = 14441
+# A live frame: a 4-byte big-endian length, then STREAM_HEADER and the
+# pixels as big-endian ARGB words. The same framing is used over TCP and UDP
+# (one frame per datagram).
+FRAME_LENGTH = struct.Struct("!I")
+STREAM_MAGIC = b"PFST"
+STREAM_HEADER = struct.Struct("!4sIHH")  # magic, sequence, width, height
+# The stream hands the panel back to the slot rotation after this long without a frame.
+STREAM_IDLE_SECONDS = 2
+
+logger = logging.getLogger(__name__)
+
+
+class StreamReceiver:
+    """
+    Receives live frames over TCP and UDP and hands them to the render loop.
+
+    Frames are not persisted or cached. Only the newest frame is kept: a frame
+    whose sequence number is not newer than the last one accepted from the
+    same sender is dropped as late, and a frame replaced by a newer one before
+    the render loop picked it up is dropped as superseded. While frames keep
+    arriving the stream holds a preempting render job, so the slot rotation
+    pauses and resumes on its own once the stream goes quiet.
+    """
+
+    def __init__(self, render_queue, width, height, port=STREAM_PORT):
+        self.render_queue = render_queue
+        self.width = width
+        self.height = height
+        self.port = port
+        self.frame_size = width * height * 4
+        self.counters = {
+            "received": 0,
+            "displayed": 0,
+            "dropped_late": 0,
+            "dropped_superseded": 0,
+            "invalid": 0,
+        }
+        self._latest = None
+        self._last_sequence = None
+        self._source = None
+        self._job = None
+        self._lock = threading.Lock()
+
+    def handle_frame(self, payload, source):
+        """
+        Validate one framed payload (without its length prefix) and queue it for display.
+
+        Returns:
+            bool: True if the frame was accepted.
+        """
+        if len(payload) != STREAM_HEADER.size + self.frame_size:
+            self._count("invalid")
+            return False
+        magic, sequence, width, height = STREAM_HEADER.unpack_from(payload)
+        if magic != STREAM_MAGIC or (width, height) != (self.width, self.height):
+            self._count("invalid")
+            return False
+
+        with self._lock:
+            self.counters["received"] += 1
+            if source != self._source or sequence == 0:
+                self._source = source
+                self._last_sequence = None
+            if self._last_sequence is not None and sequence <= self._last_sequence:
+                self.counters["dropped_late"] += 1
+                return False
+            self._last_sequence = sequence
+
+        image = decode_frame(bytes(payload[STREAM_HEADER.size:]), (width, height))
+
+        with self._lock:
+            if self._latest is not None:
+                self.counters["dropped_superseded"] += 1
+            self._latest = (sequence, image)
+            needs_job = self._job is None or self._job.status not in ("queued", "displaying")
+            if needs_job:
+                self._job = self.render_queue.submit(None, STREAM_IDLE_SECONDS, POLICY_PREEMPT, stream=self)
+        if not needs_job:
+            self.render_queue.wake()
+        return True
+
+    def has_frame(self):
+        return self._latest is not None
+
+    def take_frame(self):
+        """Return the newest (sequence, image) not yet displayed, or None."""
+        with self._lock:
+            frame, self._latest = self._latest, None
+            if frame is not None:
+                self.counters["displayed"] += 1
+            return frame
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, last_sequence=self._last_sequence,
+                        active=self._job is not None and self._job.status == "displaying")
+
+    def _count(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def serve_udp(self):
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * (FRAME_LENGTH.size + STREAM_HEADER.size + self.frame_size))
+        udp_socket.bind(("", self.port))
+        buffer = bytearray(FRAME_LENGTH.size + STREAM_HEADER.size + self.frame_size + 1)
+        view = memoryview(buffer)
+        logger.info("Listening for UDP frame streams on port %s...", self.port)
+        while True:
+            size, addr = udp_socket.recvfrom_into(buffer)
+            if size < FRAME_LENGTH.size or FRAME_LENGTH.unpack_from(buffer)[0] != size - FRAME_LENGTH.size:
+                self._count("invalid")
+                continue
+            self.handle_frame(view[FRAME_LENGTH.size:size], addr)
+
+    def serve_tcp(self):
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.bind(("", self.port))
+        server_socket.listen(4)
+        logger.info("Listening for TCP frame streams on port %s...", self.port)
+        while True:
+            client_socket, addr = server_socket.accept()
+            threading.Thread(target=self.serve_tcp_client, args=(client_socket, addr), daemon=True).start()
+
+    def serve_tcp_client(self, client_socket, addr):
+        """Read length-prefixed frames from one TCP sender into a preallocated buffer."""
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        payload_size = STREAM_HEADER.size + self.frame_size
+        buffer = bytearray(FRAME_LENGTH.size + payload_size)
+        view = memoryview(buffer)
+        try:
+            while True:
+                if not recv_into_exact(client_socket, view[:FRAME_LENGTH.size]):
+                    return
+                length = FRAME_LENGTH.unpack_from(buffer)[0]
+                if length != payload_size:
+                    self._count("invalid")
+                    return
+                if not recv_into_exact(client_socket, view[FRAME_LENGTH.size:]):
+                    return
+                self.handle_frame(view[FRAME_LENGTH.size:], addr)
+        except OSError as e:
+            logger.info("Stream from %s closed: %s", addr, e)
+        finally:
+            client_socket.close()
+
+    def start(self):
+        for target in (self.serve_udp, self.serve_tcp):
+            threading.Thread(target=target, daemon=True).start()
+
+
+def recv_into_exact(sock, view):
+    """Fill `view` from the socket; returns False if the peer closed the connection first."""
+    received = 0
+    while received < len(view):
+        count = sock.recv_into(view[received:])
+        if not count:
+            return False
+        received += count
+    return True
+
+
+def encode_frame(sequence, width, height, pixel_data):
+    """Frame packed ARGB pixels for sending to a StreamReceiver."""
+    payload = STREAM_HEADER.pack(STREAM_MAGIC, sequence, width, height) + pixel_data
+    return FRAME_LENGTH.pack(len(payload)) + payload
@@ -1,11 +1,68 @@
-import network
 import socket
 import time
 import struct
 import gc
+import os
+from binascii import crc32
 
-from rgbmatrix import RGBMatrix, RGBMatrixOptions
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 
+try:
+    import network
+except ImportError:
+    # CPython, for benchmarking the receive path off the Pico.
+    network = None
+
+try:
+    from rgbmatrix import RGBMatrix, RGBMatrixOptions
+except ImportError:
+    RGBMatrix = RGBMatrixOptions = None
+
+try:
+    from time import ticks_ms, ticks_diff
+    from gc import mem_alloc
+except ImportError:
+    # CPython has no tick clock or heap counter; transfer reports show 0 heap growth.
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+    def mem_alloc():
+        return 0
+
+# Length-prefixed uploads start with FRAME_MAGIC, then FRAME_HEADER
+# (slot, duration, crc of the pixels, pixel byte count, big-endian), then the
+# pixels as big-endian ARGB words. Anything else is read as a legacy upload:
+# slot, duration, then pixels until the sender closes the connection.
+FRAME_MAGIC = b'PFUP'
+# MicroPython's struct has no Struct class, so formats are plain strings.
+FRAME_HEADER = '!ifII'
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER)
+MAX_FRAME_BYTES = 64 * 64 * 4
+RECV_CHUNK_SIZE = 1024
+NUMBER_OF_SLOTS = 6
+SLOTS_DIR = 'slots'
+# A connection is dropped when an upload takes longer than this to arrive,
+# so a client that vanished mid-transfer without closing can't keep its
+# frame buffer, or when it sends nothing for IDLE_TIMEOUT_SECONDS.
+UPLOAD_TIMEOUT_SECONDS = 10
+IDLE_TIMEOUT_SECONDS = 60
+# Uploads received at the same time; each holds one preallocated frame buffer.
+MAX_UPLOADS = 2
+# One status byte is sent back after each length-prefixed upload.
+STATUS_OK = b'K'
+STATUS_ERROR = b'E'
+# Per-pixel tracing of legacy uploads; far too slow to leave on.
+DEBUG = False
+
+# Reused across uploads so a transfer never allocates its frame on the heap.
+frame_buffer = bytearray(MAX_FRAME_BYTES)
+header_buffer = bytearray(FRAME_HEADER_SIZE)
 
 
 def connect_to_wifi(max_attempts=10):
@@ -47,8 +104,49 @@ def recv_exact(sock, num_bytes):
     return data
 
 
+def recv_into_exact(sock, view):
+    """
+    Fill `view` from the socket in chunks of up to RECV_CHUNK_SIZE bytes.
+    Returns the number of bytes received, short only if the sender closed first.
+    """
+    recv_into = getattr(sock, 'recv_into', None) or sock.readinto
+    received = 0
+    while received < len(view):
+        count = recv_into(view[received:received + RECV_CHUNK_SIZE])
+        if not count:
+            break
+        received += count
+    return received
+
+
+def decode_frame(sock):
+    """
+    Read a length-prefixed upload (after its FRAME_MAGIC) into the shared frame buffer.
+
+    Returns:
+        tuple: (slot, duration, memoryview of the pixel bytes).
+
+    Raises:
+        ValueError: On a short read, an oversized frame or a CRC mismatch.
+    """
+    if recv_into_exact(sock, memoryview(header_buffer)) != FRAME_HEADER_SIZE:
+        raise ValueError("Incomplete frame header")
+    chosen_slot, duration, expected_crc, length = struct.unpack(FRAME_HEADER, header_buffer)
+    if length > MAX_FRAME_BYTES:
+        raise ValueError("Frame too large")
+
+    pixels = memoryview(frame_buffer)[:length]
+    if recv_into_exact(sock, pixels) != length:
+        raise ValueError("Incomplete pixel data")
+    if crc32(pixels) & 0xFFFFFFFF != expected_crc:
+        raise ValueError("CRC mismatch")
+    return chosen_slot, duration, pixels
+
+
 def decode_data(sock):
     chosen_slot_data = recv_exact(sock, 4)
+    if chosen_slot_data == FRAME_MAGIC:
+        return decode_frame(sock)
     chosen_slot = struct.unpack('!i', chosen_slot_data)[0]
 
     time_data = recv_exact(sock, 4)
@@ -66,7 +164,8 @@ def decode_data(sock):
                     raise ValueError("Incomplete pixel data")
                 pixels.extend(pixel_data)
                 counter += 1
-                print(pixel_data)
+                if DEBUG:
+                    print(pixel_data)
             gc.collect()  # Trigger garbage collection more frequently
 
         except ValueError:
@@ -88,24 +187,179 @@ def print_memory_info():
     print(f"Total memory: {gc.mem_free() + gc.mem_alloc()} bytes")
 
 
+async def read_into_exact(reader, view):
+    """
+    Async recv_into_exact: fill `view` from a stream in chunks of up to
+    RECV_CHUNK_SIZE bytes, yielding to other tasks while waiting for data.
+    Uses readinto on uasyncio; CPython's StreamReader only has read.
+    """
+    readinto = getattr(reader, 'readinto', None)
+    received = 0
+    while received < len(view):
+        chunk_view = view[received:received + RECV_CHUNK_SIZE]
+        if readinto:
+            count = await readinto(chunk_view)
+        else:
+            chunk = await reader.read(len(chunk_view))
+            count = len(chunk)
+            chunk_view[:count] = chunk
+        if not count:
+            break
+        received += count
+    return received
+
+
+def write_slot(slot, duration, pixels):
+    """Persist one slot as SLOTS_DIR/slot_<n>.bin: FRAME_HEADER, then the pixels."""
+    try:
+        os.mkdir(SLOTS_DIR)
+    except OSError:
+        pass
+    with open(f"{SLOTS_DIR}/slot_{slot}.bin", 'wb') as f:
+        f.write(struct.pack(FRAME_HEADER, slot, duration, crc32(pixels) & 0xFFFFFFFF, len(pixels)))
+        f.write(pixels)
+
+
+class UploadServer:
+    """
+    Long-running uasyncio server that takes uploads from several clients at once.
+
+    Each connection is served as its own task and may send any number of
+    length-prefixed uploads, each answered with a status byte. Legacy
+    uploads (no FRAME_MAGIC) are read until the sender closes. Frames are
+    streamed into one of MAX_UPLOADS preallocated buffers, so further clients
+    wait for a free buffer instead of allocating. A finished upload is
+    handed to `on_slot(slot, duration, pixels)`, serialized per slot.
+    Reads yield between chunks, so other tasks keep running mid-transfer.
+    An upload that doesn't arrive within `upload_timeout` seconds, or a
+    connection idle for `idle_timeout` seconds, is closed and its buffer freed.
+    """
+
+    def __init__(self, on_slot=write_slot, number_of_slots=NUMBER_OF_SLOTS, max_uploads=MAX_UPLOADS,
+                 upload_timeout=UPLOAD_TIMEOUT_SECONDS, idle_timeout=IDLE_TIMEOUT_SECONDS):
+        self.on_slot = on_slot
+        self.number_of_slots = number_of_slots
+        self.upload_timeout = upload_timeout
+        self.idle_timeout = idle_timeout
+        self.free_buffers = [frame_buffer] + [bytearray(MAX_FRAME_BYTES) for _ in range(max_uploads - 1)]
+        self.buffer_released = asyncio.Event()
+        self.slot_locks = [asyncio.Lock() for _ in range(number_of_slots)]
+        self.clients = 0
+        self.uploads = 0
+        self.failed = 0
+
+    async def acquire_buffer(self):
+        while not self.free_buffers:
+            self.buffer_released.clear()
+            await self.buffer_released.wait()
+        return self.free_buffers.pop()
+
+    def release_buffer(self, buffer):
+        self.free_buffers.append(buffer)
+        self.buffer_released.set()
+
+    async def receive_frame(self, reader, buffer, legacy_slot=None):
+        """
+        Read one upload into `buffer`. For a legacy upload `legacy_slot` holds its
+        already-read first four bytes.
+
+        Returns:
+            tuple: (slot, duration, memoryview of the pixel bytes).
+
+        Raises:
+            ValueError: On a short read, a bad slot, an oversized frame or a CRC mismatch.
+        """
+        header_data = bytearray(FRAME_HEADER_SIZE)
+        header = memoryview(header_data)
+        if legacy_slot is not None:
+            header[:4] = legacy_slot
+            if await read_into_exact(reader, header[4:8]) != 4:
+                raise ValueError("Incomplete upload header")
+            chosen_slot, duration = struct.unpack_from('!if', header_data)
+            length = await read_into_exact(reader, memoryview(buffer))
+            expected_crc = None
+        else:
+            if await read_into_exact(reader, header) != FRAME_HEADER_SIZE:
+                raise ValueError("Incomplete frame header")
+            chosen_slot, duration, expected_crc, length = struct.unpack(FRAME_HEADER, header_data)
+            if length > MAX_FRAME_BYTES:
+                raise ValueError("Frame too large")
+            if await read_into_exact(reader, memoryview(buffer)[:length]) != length:
+                raise ValueError("Incomplete pixel data")
+
+        if not 0 <= chosen_slot < self.number_of_slots:
+            raise ValueError("Invalid slot")
+        pixels = memoryview(buffer)[:length]
+        if expected_crc is not None and crc32(pixels) & 0xFFFFFFFF != expected_crc:
+            raise ValueError("CRC mismatch")
+        return chosen_slot, duration, pixels
+
+    async def handle_client(self, reader, writer):
+        self.clients += 1
+        magic = bytearray(4)
+        try:
+            while await asyncio.wait_for(read_into_exact(reader, memoryview(magic)), self.idle_timeout) == 4:
+                start = ticks_ms()
+                allocated = mem_alloc()
+                legacy = magic != FRAME_MAGIC
+                buffer = await self.acquire_buffer()
+                try:
+                    chosen_slot, duration, pixels = await asyncio.wait_for(self.receive_frame(
+                        reader, buffer, bytes(magic) if legacy else None), self.upload_timeout)
+                    async with self.slot_locks[chosen_slot]:
+                        self.on_slot(chosen_slot, duration, pixels)
+                    self.uploads += 1
+                    print(f"Stored {len(pixels)} bytes in slot {chosen_slot} in {ticks_diff(ticks_ms(), start)} ms, "
+                          f"heap grew by {mem_alloc() - allocated} bytes")
+                    status = STATUS_OK
+                except ValueError as e:
+                    self.failed += 1
+                    print(f"Upload failed: {e}")
+                    status = STATUS_ERROR
+                except asyncio.TimeoutError:
+                    self.failed += 1
+                    print("Upload timed out")
+                    raise
+                finally:
+                    self.release_buffer(buffer)
+                if legacy:
+                    break
+                writer.write(status)
+                await writer.drain()
+                if status == STATUS_ERROR:
+                    break
+        except asyncio.TimeoutError:
+            print("Connection timed out")
+        except OSError as e:
+            print(f"Connection error: {e}")
+        finally:
+            self.clients -= 1
+            writer.close()
+            await writer.wait_closed()
+
+
+async def serve(ip_address, port=14440, backlog=4, background=()):
+    """
+    Run the upload server forever, alongside any `background` coroutines
+    (display refresh, discovery), which keep running during transfers.
+    """
+    upload_server = UploadServer()
+    await asyncio.start_server(upload_server.handle_client, ip_address, port, backlog=backlog)
+    print('Waiting for connections...')
+    for coroutine in background:
+        asyncio.create_task(coroutine)
+    while True:
+        await asyncio.sleep(60)
+        print_memory_info()
+
+
 def main():
     print_memory_info()
     ip_address = connect_to_wifi()
     print_memory_info()
     if not ip_address:
         return
-    print_memory_info()
-    server_socket = setup_server(ip_address)
-    client_socket, client_address = server_socket.accept()
-    print('Connection from:', client_address)
-    print_memory_info()
-    chosen_slot, time, pixels = decode_data(client_socket)
-    print_memory_info()
-    print(f"Chosen Slot: {chosen_slot}, Time: {time}, Pixels: {pixels}")
-    print(f"len(pixels): {len(pixels)}")
-    
-    client_socket.close()
-    server_socket.close()
+    asyncio.run(serve(ip_address))
 
 
 if __name__ == "__main__":